@@ -0,0 +1,218 @@
+"""Places API（places:searchText と places/{id}）のローカル代替サーバー
+
+シード固定の合成データを返し、応答遅延・エラー率・429の発生率を設定できる。
+スクリプトからは環境変数 PLACES_API_BASE_URL を http://127.0.0.1:<port>/v1 にして使う。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+NAME_PREFIXES = ["珈琲", "喫茶", "カフェ", "ベーカリー", "食堂", "ビストロ", "トラットリア", "茶房", "キッチン", "ダイニング"]
+NAME_SUFFIXES = ["こもれび", "ひだまり", "さくら", "あおぞら", "みなと", "つばめ", "やまびこ", "もみじ", "しずく", "ほたる"]
+AREAS = ["渋谷", "新宿", "吉祥寺", "鎌倉", "横浜", "二子玉川", "自由が丘", "中目黒", "代々木上原", "三軒茶屋"]
+PRIMARY_TYPES = ["カフェ", "喫茶店", "レストラン", "ベーカリー", "イタリア料理店", "和食店", "ドッグカフェ", "公園"]
+BUSINESS_STATUSES = [("OPERATIONAL", 0.93), ("CLOSED_TEMPORARILY", 0.03), ("CLOSED_PERMANENTLY", 0.04)]
+WEEKDAYS = ["日曜日", "月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日"]
+
+
+def _normalize(text):
+    return "".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def _opening_hours(rng):
+    """ランダムな営業時間（currentOpeningHours相当）を作る。一部は深夜営業"""
+    open_hour = rng.randint(7, 11)
+    overnight = rng.random() < 0.1
+    close_hour = rng.randint(0, 3) if overnight else rng.randint(17, 23)
+    closed_day = rng.choice([None, 1, 2, 3])
+    periods = []
+    descriptions = []
+    for day in range(7):
+        if day == closed_day:
+            descriptions.append(f"{WEEKDAYS[day]}: 定休日")
+            continue
+        close_day = (day + 1) % 7 if overnight else day
+        periods.append({
+            "open": {"day": day, "hour": open_hour, "minute": 0},
+            "close": {"day": close_day, "hour": close_hour, "minute": 0},
+        })
+        descriptions.append(f"{WEEKDAYS[day]}: {open_hour}時00分～{close_hour}時00分")
+    return {"openNow": rng.random() < 0.5, "periods": periods, "weekdayDescriptions": descriptions}
+
+
+def generate_places(count=20000, seed=42):
+    """シード固定で合成の場所データを作る"""
+    rng = random.Random(seed)
+    statuses, weights = zip(*BUSINESS_STATUSES)
+    places = []
+    for i in range(count):
+        area = rng.choice(AREAS)
+        name = f"{rng.choice(NAME_PREFIXES)}{rng.choice(NAME_SUFFIXES)} {area}{i}号店"
+        primary_type = rng.choice(PRIMARY_TYPES)
+        place = {
+            "id": f"fake-{seed}-{i:06d}",
+            "displayName": {"text": name, "languageCode": "ja"},
+            "primaryTypeDisplayName": {"text": primary_type, "languageCode": "ja"},
+            "googleMapsUri": f"https://maps.google.com/?cid={seed}{i:06d}",
+            "location": {
+                "latitude": round(35.55 + rng.random() * 0.25, 6),
+                "longitude": round(139.55 + rng.random() * 0.25, 6),
+            },
+            "formattedAddress": f"日本、東京都{area}{rng.randint(1, 5)}丁目{rng.randint(1, 30)}-{rng.randint(1, 20)}",
+            "businessStatus": rng.choices(statuses, weights)[0],
+        }
+        if rng.random() < 0.9:
+            place["currentOpeningHours"] = _opening_hours(rng)
+        places.append(place)
+    return places
+
+
+def project(place, field_mask):
+    """フィールドマスクに含まれるトップレベルのフィールドだけを返す"""
+    fields = {field.strip().split(".")[0] for field in field_mask.split(",")}
+    if "*" in fields:
+        return dict(place)
+    return {key: value for key, value in place.items() if key in fields}
+
+
+class FakePlacesApi:
+    """合成データに対してPlaces APIの応答を作る"""
+
+    def __init__(self, places, latency=0.05, jitter=0.02, error_rate=0.0, rate_limit_rate=0.0,
+                 distractors=2, seed=0):
+        self.places = places
+        self.by_id = {place["id"]: place for place in places}
+        self.by_name = {_normalize(place["displayName"]["text"]): place for place in places}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.distractors = distractors
+        self.stats = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """リクエスト数の統計のコピーを返す"""
+        with self._lock:
+            return Counter(self.stats)
+
+    def _inject(self, endpoint):
+        """遅延を入れ、必要に応じて429または500の応答を返す"""
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.latency, self.jitter))
+            roll = self._rng.random()
+            self.stats[f"{endpoint}.requests"] += 1
+        time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            with self._lock:
+                self.stats[f"{endpoint}.429"] += 1
+            return 429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.stats[f"{endpoint}.500"] += 1
+            return 500, {"error": {"code": 500, "status": "INTERNAL"}}
+        return None
+
+    def search_text(self, payload, field_mask):
+        injected = self._inject("searchText")
+        if injected:
+            return injected
+        query = payload.get("textQuery", "")
+        match = self.by_name.get(_normalize(query))
+        # 検索語ごとに決まった紛らわしい候補を混ぜる
+        rng = random.Random(zlib.crc32(query.encode("utf-8")))
+        candidates = rng.sample(self.places, min(self.distractors, len(self.places)))
+        if match:
+            candidates = [match] + [place for place in candidates if place is not match]
+        limit = payload.get("maxResultCount", 20)
+        mask = ",".join(field.strip().removeprefix("places.") for field in field_mask.split(","))
+        return 200, {"places": [project(place, mask) for place in candidates[:limit]]}
+
+    def get_place(self, place_id, field_mask):
+        injected = self._inject("places")
+        if injected:
+            return injected
+        place = self.by_id.get(place_id)
+        if place is None:
+            return 404, {"error": {"code": 404, "status": "NOT_FOUND"}}
+        return 200, project(place, field_mask)
+
+
+class FakePlacesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に送るため、Nagleアルゴリズムと遅延ACKで約40msの待ちが入るのを防ぐ
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        api = self.server.api
+        if path == "/_stats":
+            self._send(200, dict(api.snapshot()))
+        elif path.startswith("/v1/places/"):
+            place_id = unquote(path[len("/v1/places/"):])
+            self._send(*api.get_place(place_id, self.headers.get("X-Goog-FieldMask", "*")))
+        else:
+            self._send(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if path == "/v1/places:searchText":
+            self._send(*self.server.api.search_text(payload, self.headers.get("X-Goog-FieldMask", "*")))
+        else:
+            self._send(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    """別スレッドでサーバーを起動し、(server, ベースURL) を返す"""
+    server = ThreadingHTTPServer((host, port), FakePlacesHandler)
+    server.daemon_threads = True
+    server.api = api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='Places APIのローカル代替サーバーを起動する')
+    parser.add_argument('--port', type=int, default=8099, help='待ち受けポート（デフォルト: 8099）')
+    parser.add_argument('--places', type=int, default=20000, help='合成データの件数（デフォルト: 20000）')
+    parser.add_argument('--seed', type=int, default=42, help='合成データのシード（デフォルト: 42）')
+    parser.add_argument('--latency', type=float, default=0.05, help='平均応答遅延（秒）')
+    parser.add_argument('--jitter', type=float, default=0.02, help='応答遅延の標準偏差（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500エラーを返す割合')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='429を返す割合')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    api = FakePlacesApi(generate_places(args.places, args.seed), args.latency, args.jitter,
+                        args.error_rate, args.rate_limit_rate)
+    server, base_url = start_server(api, port=args.port)
+    print(f"🚀 Places API代替サーバーを起動しました: {base_url}（{args.places}件）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,318 @@
+"""取り込み・更新スクリプトのスループットをローカル環境だけで計測するベンチマーク
+
+Places APIはbench/fake_places_server.pyの代替サーバー、MongoDBはインメモリ（mongomock）
+または使い捨てのローカルMongoDBを使う。パイプラインごとに別プロセスで実行し、
+処理速度・1件あたりのAPI呼び出し数・段階別レイテンシ（p50/p99）・最大RSSを出力する。
+
+使用例: python bench/run_benchmarks.py --places 2000 --latency 0.05 --rate-limit-rate 0.02
+"""
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench.fake_places_server import FakePlacesApi, generate_places, start_server  # noqa: E402
+
+PIPELINES = ["import", "opening_hours", "business_status", "refresh"]
+MONGO_METHODS = ["find", "find_one", "count_documents", "estimated_document_count", "update_one", "update_many",
+                 "bulk_write", "insert_many", "create_index"]
+
+
+def percentile(values, fraction):
+    """最近傍順位法でパーセンタイルを返す"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """このプロセスの最大RSS（MB）を返す"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # LinuxはKB、macOSはバイト単位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def install_http_timer(latencies):
+    """すべてのHTTPリクエストの所要時間を記録する（requestsとhttpxの両方）"""
+    from requests.adapters import HTTPAdapter
+    classes = [HTTPAdapter]
+    try:
+        import httpx
+        classes.append(httpx.Client)
+    except ImportError:
+        pass
+
+    for cls in classes:
+        def timed_send(self, request, *args, _original=cls.send, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(self, request, *args, **kwargs)
+            finally:
+                latencies["http"].append(time.perf_counter() - start)
+
+        cls.send = timed_send
+
+
+def install_in_memory_mongo(latencies):
+    """pymongo.MongoClientをインメモリの共有クライアントに置き換え、操作ごとの所要時間を記録する"""
+    import mongomock
+    import pymongo
+    from mongomock.collection import BulkOperationBuilder
+
+    # 新しいpymongoのUpdateOneはmongomockが受け付けないsort引数を渡すため取り除く
+    original_add_update = BulkOperationBuilder.add_update
+
+    def add_update(self, *args, sort=None, **kwargs):
+        return original_add_update(self, *args, **kwargs)
+
+    BulkOperationBuilder.add_update = add_update
+
+    for name in MONGO_METHODS:
+        original = getattr(mongomock.Collection, name)
+
+        def timed(self, *args, _original=original, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                latencies[f"mongo.{_name}"].append(time.perf_counter() - start)
+
+        setattr(mongomock.Collection, name, timed)
+
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+
+
+def install_mongo_listener(latencies):
+    """実MongoDBへのコマンドごとの所要時間を記録する"""
+    from pymongo import monitoring
+
+    class Listener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            latencies[f"mongo.{event.command_name}"].append(event.duration_micros / 1e6)
+
+        def failed(self, event):
+            latencies[f"mongo.{event.command_name}"].append(event.duration_micros / 1e6)
+
+    monitoring.register(Listener())
+
+
+def seed_places(collection, places):
+    """更新系スクリプト用に営業時間・営業状態を持たないレコードを登録する"""
+    collection.insert_many([
+        {
+            "id": place["id"],
+            "location_name": place["displayName"],
+            "alias": place["displayName"]["text"],
+            "primary_type": place["primaryTypeDisplayName"],
+            "url": place["googleMapsUri"],
+            "location": place["location"],
+            "category": i % 3 + 1,
+            "businessStatus": "OPERATIONAL",
+        }
+        for i, place in enumerate(places)
+    ])
+
+
+def bench_import(collection, places, config, workdir):
+    """main.pyのCSV取り込み（一括解決モード）"""
+    import main
+
+    for index, (csv_file, _) in enumerate(main.csv_files):
+        with open(os.path.join(workdir, csv_file), "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["タイトル", "メモ", "URL"])
+            for place in places[index::len(main.csv_files)]:
+                writer.writerow([place["displayName"]["text"], "", place["googleMapsUri"]])
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.argv = ["main.py", "--batch", "--journal", "journal.sqlite3", "--review-file", "review.jsonl"]
+    try:
+        main.main()
+    finally:
+        os.chdir(cwd)
+
+
+def bench_opening_hours(collection, places, config, workdir):
+    """update_opening_hours.pyによる営業時間の取得"""
+    import update_opening_hours
+    update_opening_hours.update_opening_hours_for_missing_records(config["concurrency"], config["rate"])
+
+
+def bench_business_status(collection, places, config, workdir):
+    """update_business_status.pyによる営業状態の確認"""
+    import update_business_status
+    update_business_status.update_closed_business_status(config["concurrency"], config["rate"])
+
+
+def bench_refresh(collection, places, config, workdir):
+    """refresh_places.pyによる営業状態・営業時間の一括更新"""
+    import refresh_places
+    refresh_places.refresh_stale_places(config["concurrency"], config["rate"], max_calls=len(places))
+
+
+BENCHMARKS = {
+    "import": (bench_import, False),
+    "opening_hours": (bench_opening_hours, True),
+    "business_status": (bench_business_status, True),
+    "refresh": (bench_refresh, True),
+}
+
+
+def run_pipeline(name, config, results):
+    """子プロセスで1つのパイプラインを実行し、計測結果をresultsに入れる"""
+    os.environ["PLACES_API_BASE_URL"] = config["base_url"]
+    os.environ["GOOGLE_MAPS_API_KEY"] = "fake-key"
+    os.environ["PLACES_CACHE_DISABLED"] = "1"
+    os.environ["PLACES_API_RATE"] = str(config["rate"])
+    os.environ["MONGODB_ADDRESS"] = config["mongo"]
+
+    latencies = defaultdict(list)
+    install_http_timer(latencies)
+    if config["mongo"] == "memory":
+        install_in_memory_mongo(latencies)
+    else:
+        install_mongo_listener(latencies)
+
+    import pymongo
+    collection = pymongo.MongoClient(os.environ["MONGODB_ADDRESS"]).places.place_info
+    collection.drop()
+
+    places = generate_places(config["dataset_size"], config["seed"])[:config["places"]]
+    benchmark, needs_seed = BENCHMARKS[name]
+    if needs_seed:
+        seed_places(collection, places)
+    latencies.clear()
+
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, "w") as devnull:
+        os.environ["PLACES_SNAPSHOT_DIR"] = os.path.join(workdir, "snapshots")
+        os.environ["PLACES_EVENT_LOG"] = os.path.join(workdir, "place_events.jsonl")
+        output = sys.stdout if config["verbose"] else devnull
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            benchmark(collection, places, config, workdir)
+        elapsed = time.perf_counter() - start
+
+    results.put({
+        "pipeline": name,
+        "places": len(places),
+        "elapsed": elapsed,
+        "stages": {
+            stage: {"count": len(values), "p50_ms": percentile(values, 0.5) * 1000,
+                    "p99_ms": percentile(values, 0.99) * 1000}
+            for stage, values in sorted(latencies.items()) if values
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def wait_for_result(process, results):
+    """子プロセスの計測結果を待つ。結果を返さずに終了した場合は例外にする"""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"パイプラインが異常終了しました (exit code: {process.exitcode})")
+
+
+def print_report(result):
+    print(f"\n=== {result['pipeline']} ===")
+    print(f"   • 処理件数: {result['places']}件 / {result['elapsed']:.2f}秒 "
+          f"({result['places_per_second']:.1f}件/秒)")
+    print(f"   • API呼び出し: {result['api_calls']}回 ({result['api_calls_per_place']:.2f}回/件, "
+          f"429: {result['rate_limited']}回, 5xx: {result['server_errors']}回)")
+    print(f"   • 最大RSS: {result['peak_rss_mb']:.1f}MB")
+    for stage, values in result["stages"].items():
+        print(f"   • {stage}: {values['count']}回 p50 {values['p50_ms']:.2f}ms / p99 {values['p99_ms']:.2f}ms")
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='取り込み・更新スクリプトのスループットを計測する')
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=PIPELINES,
+                       help='計測するパイプライン（デフォルト: すべて）')
+    parser.add_argument('--places', type=int, default=2000, help='各パイプラインで処理する件数（デフォルト: 2000）')
+    parser.add_argument('--dataset-size', type=int, default=20000, help='合成データの件数（デフォルト: 20000）')
+    parser.add_argument('--seed', type=int, default=42, help='合成データのシード（デフォルト: 42）')
+    parser.add_argument('--latency', type=float, default=0.05, help='代替サーバーの平均応答遅延（秒）')
+    parser.add_argument('--jitter', type=float, default=0.02, help='代替サーバーの応答遅延の標準偏差（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500エラーを返す割合')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='429を返す割合')
+    parser.add_argument('--concurrency', type=int, default=8, help='更新系スクリプトの同時リクエスト数')
+    parser.add_argument('--rate', type=float, default=200.0, help='更新系スクリプトの1秒あたりの最大リクエスト数')
+    parser.add_argument('--mongo', default='memory',
+                       help='memory（mongomock）または使い捨てMongoDBの接続文字列。places.place_infoは削除される')
+    parser.add_argument('--json-output', help='計測結果をJSON Linesで追記するファイル')
+    parser.add_argument('--verbose', '-v', action='store_true', help='スクリプトの出力を表示する')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.places > args.dataset_size:
+        print("エラー: --places は --dataset-size 以下にしてください")
+        sys.exit(1)
+
+    api = FakePlacesApi(generate_places(args.dataset_size, args.seed), args.latency, args.jitter,
+                        args.error_rate, args.rate_limit_rate)
+    server, base_url = start_server(api)
+    print(f"🚀 Places API代替サーバー: {base_url}（{args.dataset_size}件）")
+
+    config = {
+        "base_url": base_url,
+        "mongo": args.mongo,
+        "places": args.places,
+        "dataset_size": args.dataset_size,
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "verbose": args.verbose,
+    }
+    context = multiprocessing.get_context("spawn")
+    try:
+        for name in args.pipelines:
+            before = api.snapshot()
+            results = context.Queue()
+            process = context.Process(target=run_pipeline, args=(name, config, results))
+            process.start()
+            result = wait_for_result(process, results)
+            process.join()
+
+            delta = api.snapshot() - before
+            api_calls = sum(count for key, count in delta.items() if key.endswith(".requests"))
+            result.update({
+                "places_per_second": result["places"] / result["elapsed"],
+                "api_calls": api_calls,
+                "api_calls_per_place": api_calls / result["places"],
+                "rate_limited": sum(count for key, count in delta.items() if key.endswith(".429")),
+                "server_errors": sum(count for key, count in delta.items() if key.endswith(".500")),
+            })
+            print_report(result)
+            if args.json_output:
+                with open(args.json_output, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
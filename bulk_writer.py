@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from instrumentation import metrics
+
+_STOP = object()
+
+
+class BulkWriter:
+    """UpdateOneをまとめてbulk_writeするバックグラウンド書き込みステージ
+
+    バッチサイズまたは経過時間のどちらかに達した時点でフラッシュする。
+    書き込みは専用スレッドで行うため、API取得と並行して進む。
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval=2.0, verbose=True):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+        self.batch_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.upserted_count = 0
+        self.error_count = 0
+        self.queued_count = 0
+        self._queue = queue.Queue(maxsize=batch_size * 4)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        self._thread.start()
+
+    def update_one(self, filter, update, upsert=False):
+        """書き込みキューにUpdateOneを追加する"""
+        self.queued_count += 1
+        self._queue.put(UpdateOne(filter, update, upsert=upsert))
+
+    @property
+    def unmatched_count(self):
+        """条件に一致するレコードがなく、何も書き込まれなかった操作数（close後に使う）"""
+        return self.queued_count - self.matched_count - self.upserted_count - self.error_count
+
+    def close(self):
+        """残りの操作をフラッシュして書き込みスレッドを終了する"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                op = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(batch)
+                batch = []
+                continue
+            if op is _STOP:
+                break
+            if not batch:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(op)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        self._flush(batch)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        self.batch_count += 1
+        try:
+            with metrics.stage("mongo_write"):
+                result = self.collection.bulk_write(batch, ordered=False)
+            details = result.bulk_api_result
+            errors = 0
+        except BulkWriteError as e:
+            details = e.details
+            errors = len(details.get("writeErrors", []))
+        except Exception as e:
+            print(f"❌ バッチ書き込みエラー: {str(e)}")
+            self.error_count += len(batch)
+            return
+
+        matched = details.get("nMatched", 0)
+        modified = details.get("nModified", 0)
+        upserted = details.get("nUpserted", 0)
+        self.matched_count += matched
+        self.modified_count += modified
+        self.upserted_count += upserted
+        self.error_count += errors
+        if self.verbose:
+            print(f"📝 バッチ#{self.batch_count} 書き込み完了: {len(batch)}件 "
+                  f"(一致: {matched}, 更新: {modified}, 新規: {upserted}, 失敗: {errors})")
@@ -0,0 +1,89 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from instrumentation import metrics
+
+# 更新スクリプトがレコードから読むフィールドだけを取得する
+SCAN_PROJECTION = {"id": 1, "location_name.text": 1, "alias": 1, "address": 1, "fetchedAt": 1, "businessStatus": 1}
+
+
+def id_ranges(collection, partitions):
+    """コレクションを_idの範囲でほぼ同じ件数のpartitions個に分割する
+
+    境界は_idインデックスだけを使って求める。戻り値は [(下限, 上限)] で、
+    下限は含み上限は含まない。Noneは端まで。
+    """
+    if partitions <= 1:
+        return [(None, None)]
+    total = collection.estimated_document_count()
+    if total < partitions:
+        return [(None, None)]
+
+    step = total // partitions
+    bounds = []
+    for i in range(1, partitions):
+        cursor = collection.find({}, {"_id": 1}).sort("_id", 1).skip(i * step).limit(1)
+        document = next(iter(cursor), None)
+        if document is not None and (not bounds or document["_id"] > bounds[-1]):
+            bounds.append(document["_id"])
+
+    edges = [None] + bounds + [None]
+    return list(zip(edges, edges[1:]))
+
+
+def partition_query(query, id_range):
+    """検索条件に_idの範囲を加える"""
+    lower, upper = id_range
+    bounds = {}
+    if lower is not None:
+        bounds["$gte"] = lower
+    if upper is not None:
+        bounds["$lt"] = upper
+    if not bounds:
+        return query
+    return {"$and": [query, {"_id": bounds}]}
+
+
+def _init_worker(verbosity):
+    instrumentation.set_verbosity(verbosity)
+
+
+def _run_worker(worker, id_range, args):
+    # 同じプロセスで前に処理した範囲の集計を持ち越さない
+    metrics.reset()
+    result = worker(id_range, *args)
+    return result, metrics.state()
+
+
+def run_partitions(worker, ranges, *args):
+    """各_id範囲を worker(範囲, *args) として別プロセスで並行に処理する
+
+    workerはモジュールの最上位に定義し、MongoClientは自分で開くこと。
+    各プロセスの計測結果はこのプロセスのmetricsに合算し、workerの戻り値をリストで返す。
+    """
+    if len(ranges) == 1:
+        return [worker(ranges[0], *args)]
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context,
+                             initializer=_init_worker, initargs=(instrumentation._verbosity,)) as executor:
+        futures = [executor.submit(_run_worker, worker, id_range, args) for id_range in ranges]
+        results = []
+        for future in futures:
+            result, state = future.result()
+            metrics.merge(state)
+            results.append(result)
+    return results
+
+
+def combine_results(results):
+    """workerが返した辞書を合算する（数値は合計、リストは連結）"""
+    combined = {}
+    for result in results:
+        for key, value in result.items():
+            if isinstance(value, list):
+                combined.setdefault(key, []).extend(value)
+            else:
+                combined[key] = combined.get(key, 0) + value
+    return combined
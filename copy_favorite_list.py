@@ -1,81 +1,204 @@
+import argparse
+import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-import time
-import csv
-
-# # ChromeDriverのパスを指定してServiceオブジェクトを作成
-# service = Service('/home/atsushi/dev/daisuke-cafe-search/chromedriver-linux64/chromedriver')
-
-# # ChromeOptionsを作成して新しいChromeブラウザのバイナリパスを指定
-# options = Options()
-# options.binary_location = '/home/atsushi/dev/daisuke-cafe-search/chrome-linux64/chrome'
-
-# options.add_argument("user-data-dir=/home/atsushi/.config/google-chrome")  # プロファイルのパス
-# options.add_argument("profile-directory=Default")  # プロファイル名（例: Default, Profile 1）
-
-# # 追加のオプションを設定
-# options.add_argument("--remote-debugging-port=9222")
-# options.add_argument("--no-sandbox")
-# options.add_argument("--disable-dev-shm-usage")
-
-options = Options()
-options.debugger_address = "localhost:9222"
-
-# WebDriverを作成
-# driver = webdriver.Chrome(service=service, options=options)
-driver = webdriver.Chrome(options=options)
-
-# CSVファイルを読み込む
-with open('Converted_犬外席OK、散歩途中テイクアウトOK飲食店2.csv', newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        url = row['url']
-        # list_name = row['list_name']
-        list_name = 'backup_new'
-        comment = row['comment']
-
-        # Googleマップを開く
-        driver.get(url)
-        time.sleep(5)  # ページが完全に読み込まれるまで待機
-
-        # お気に入り保存ボタンをクリック
-        save_button = driver.find_element(By.XPATH, '//button[@data-value="Directions"]/parent::div/following-sibling::div/button')
-        save_button.click()
-        time.sleep(3)
-
-        # リスト名を選択
-        list_input = driver.find_element(By.XPATH, f'//div[text()="{list_name}"]/ancestor::div[@jsaction][1]')
-        # list_input.click()
-        list_input.send_keys(list_name)
-        list_input.send_keys(Keys.RETURN)
-        time.sleep(3)
-
-        if not comment:
-            continue
-        
-        place_list_button = driver.find_element(By.XPATH, '//button[@aria-label="Show place lists details"]')
-        place_list_button.click()
-        time.sleep(3)
-
-        add_note_button = driver.find_element(By.XPATH, f'//button[@aria-label="Add note in {list_name}"]')
-        add_note_button.click()
-        time.sleep(3)
-
-
-        # # コメントを入力
-        comment_input = driver.find_element(By.XPATH, '//h1[text()="Add note"]/following::textarea[1]')
-        comment_input.send_keys(comment)
-        # comment_input.send_keys(Keys.RETURN)
-        time.sleep(3)
-
-        done_btn = driver.find_element(By.XPATH, '//button[text()="Done"]')
-        done_btn.click()
-        time.sleep(3)
-
-
-# ブラウザを閉じる
-driver.quit()
-
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from import_journal import ImportJournal, row_hash
+
+DEFAULT_CSV_FILE = 'Converted_犬外席OK、散歩途中テイクアウトOK飲食店2.csv'
+DEFAULT_LIST_NAME = 'backup_new'
+DEFAULT_JOURNAL = '.copy_favorite_journal.sqlite3'
+DEFAULT_DEBUGGER_ADDRESS = 'localhost:9222'
+
+# 各操作の対象
+SAVE_BUTTON_XPATH = '//button[@data-value="Directions"]/parent::div/following-sibling::div/button'
+LIST_ITEM_XPATH = '//div[text()="{list_name}"]/ancestor::div[@jsaction][1]'
+PLACE_LIST_BUTTON_XPATH = '//button[@aria-label="Show place lists details"]'
+ADD_NOTE_BUTTON_XPATH = '//button[@aria-label="Add note in {list_name}"]'
+NOTE_INPUT_XPATH = '//h1[text()="Add note"]/following::textarea[1]'
+DONE_BUTTON_XPATH = '//button[text()="Done"]'
+
+
+class DriverPool:
+    """ワーカースレッドごとにWebDriverのセッションを1つずつ割り当てる
+
+    通常はリモートデバッグ中のChrome（ログイン済みのプロファイル）に接続し、
+    セッションごとに新しいタブを開いて操作する。launch=Trueの場合は新しいChromeを起動する。
+    """
+
+    def __init__(self, debugger_addresses=None, launch=False, headless=False):
+        self.debugger_addresses = list(debugger_addresses or [DEFAULT_DEBUGGER_ADDRESS])
+        self.launch = launch
+        self.headless = headless
+        self.drivers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _create(self):
+        options = Options()
+        with self._lock:
+            index = len(self.drivers)
+            if not self.launch:
+                options.debugger_address = self.debugger_addresses[index % len(self.debugger_addresses)]
+            elif self.headless:
+                options.add_argument("--headless=new")
+            driver = webdriver.Chrome(options=options)
+            self.drivers.append(driver)
+        if not self.launch:
+            # 同じブラウザに接続した他のセッションと操作するタブが重ならないようにする
+            driver.switch_to.new_window('tab')
+        return driver
+
+    def get(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            driver = self._create()
+            self._local.driver = driver
+        return driver
+
+    def quit(self):
+        for driver in self.drivers:
+            try:
+                if not self.launch:
+                    driver.close()
+                driver.quit()
+            except WebDriverException:
+                pass
+
+
+def click_when_ready(wait, xpath):
+    """要素がクリックできる状態になるまで待ってクリックする"""
+    element = wait.until(EC.element_to_be_clickable((By.XPATH, xpath)))
+    element.click()
+    return element
+
+
+def save_to_list(driver, url, list_name, comment, timeout=15):
+    """1件の場所をリストに保存し、コメントがあればメモを追加する"""
+    wait = WebDriverWait(driver, timeout)
+
+    # Googleマップを開き、保存ボタンが押せるようになるまで待つ
+    driver.get(url)
+    click_when_ready(wait, SAVE_BUTTON_XPATH)
+
+    # リスト名を選択し、保存ダイアログが閉じるまで待つ
+    list_item_xpath = LIST_ITEM_XPATH.format(list_name=list_name)
+    list_input = wait.until(EC.visibility_of_element_located((By.XPATH, list_item_xpath)))
+    list_input.send_keys(list_name)
+    list_input.send_keys(Keys.RETURN)
+    wait.until(EC.invisibility_of_element_located((By.XPATH, list_item_xpath)))
+
+    if not comment:
+        return
+
+    click_when_ready(wait, PLACE_LIST_BUTTON_XPATH)
+    click_when_ready(wait, ADD_NOTE_BUTTON_XPATH.format(list_name=list_name))
+
+    # コメントを入力し、メモの入力欄が閉じるまで待つ
+    comment_input = wait.until(EC.visibility_of_element_located((By.XPATH, NOTE_INPUT_XPATH)))
+    comment_input.send_keys(comment)
+    click_when_ready(wait, DONE_BUTTON_XPATH)
+    wait.until(EC.invisibility_of_element_located((By.XPATH, NOTE_INPUT_XPATH)))
+
+
+def read_rows(csv_file):
+    """CSVファイルからurlとcommentを読み込む"""
+    with open(csv_file, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            yield row['url'], row.get('comment') or ''
+
+
+def copy_favorite_list(csv_file, list_name, workers=3, debugger_addresses=None, launch=False,
+                       headless=False, journal_path=DEFAULT_JOURNAL, reset_journal=False, timeout=15):
+    """CSVの場所を複数のブラウザセッションで並行してリストに保存する
+
+    保存できたURLは進捗記録に書き込み、再実行時には飛ばす。
+    """
+    journal = ImportJournal(journal_path, batch_size=1)
+    journal_key = f"{csv_file}:{list_name}"
+    if reset_journal:
+        journal.reset(journal_key)
+    completed = journal.completed(journal_key)
+
+    rows = []
+    skipped = 0
+    for url, comment in read_rows(csv_file):
+        if row_hash(url) in completed:
+            skipped += 1
+        else:
+            rows.append((url, comment))
+
+    print(f"📊 保存対象: {len(rows)}件（保存済みのためスキップ: {skipped}件）")
+    print(f"   • リスト名: {list_name}")
+    print(f"   • 並列数: {workers}")
+
+    pool = DriverPool(debugger_addresses, launch, headless)
+
+    def save(row):
+        url, comment = row
+        save_to_list(pool.get(), url, list_name, comment, timeout)
+
+    saved_count = 0
+    failed_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(save, row): row for row in rows}
+            for i, future in enumerate(as_completed(futures), 1):
+                url, _ = futures[future]
+                try:
+                    future.result()
+                except WebDriverException as e:
+                    failed_count += 1
+                    print(f"❌ [{i}/{len(rows)}] 保存に失敗しました: {url} - {e.__class__.__name__}")
+                    continue
+                journal.mark_done(journal_key, row_hash(url))
+                saved_count += 1
+                print(f"✓ [{i}/{len(rows)}] 保存しました: {url}")
+    finally:
+        pool.quit()
+        journal.close()
+
+    print("=" * 60)
+    print(f"📊 処理結果:")
+    print(f"   • 保存成功: {saved_count}件")
+    print(f"   • 保存失敗: {failed_count}件（再実行すると失敗した場所だけを処理します）")
+    print(f"   • スキップ: {skipped}件")
+    print("=" * 60)
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='CSVの場所をGoogleマップのリストに保存する')
+    parser.add_argument('csv_file', nargs='?', default=DEFAULT_CSV_FILE,
+                       help='url, comment列を持つCSVファイル')
+    parser.add_argument('--list-name', default=DEFAULT_LIST_NAME,
+                       help=f'保存先のリスト名（デフォルト: {DEFAULT_LIST_NAME}）')
+    parser.add_argument('--workers', '-n', type=int, default=3,
+                       help='同時に操作するブラウザのタブ（セッション）数（デフォルト: 3）')
+    parser.add_argument('--debugger-address', action='append', dest='debugger_addresses',
+                       help=f'接続するリモートデバッグ中のChrome（デフォルト: {DEFAULT_DEBUGGER_ADDRESS}）。複数指定可')
+    parser.add_argument('--launch', action='store_true',
+                       help='リモートデバッグ中のChromeに接続せず、セッションごとに新しいChromeを起動する')
+    parser.add_argument('--headless', action='store_true',
+                       help='--launchで起動するChromeをヘッドレスで動かす')
+    parser.add_argument('--timeout', type=float, default=15,
+                       help='各要素が操作できるようになるまで待つ最大秒数（デフォルト: 15）')
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL,
+                       help=f'保存済みURLを記録するファイル（デフォルト: {DEFAULT_JOURNAL}）')
+    parser.add_argument('--reset-journal', action='store_true',
+                       help='このCSVとリスト名の保存済み記録を消去してから実行する')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    copy_favorite_list(args.csv_file, args.list_name, args.workers, args.debugger_addresses,
+                       args.launch, args.headless, args.journal, args.reset_journal, args.timeout)
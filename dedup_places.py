@@ -0,0 +1,261 @@
+import argparse
+import json
+import math
+import os
+import time
+from collections import defaultdict
+
+from dotenv import load_dotenv
+from pymongo import DeleteMany, MongoClient, UpdateOne
+
+from freshness import FAILURE_COUNT_FIELD
+from place_document import CONTENT_HASH_FIELD, PENDING_FIELD
+from place_matching import distance_meters, normalize_name
+from work_lease import LEASES_FIELD
+
+# 同一店舗とみなす距離（メートル）
+DEFAULT_RADIUS = 100
+
+# 食い違いを報告するフィールド
+CONFLICT_FIELDS = ["category", "businessStatus", "primary_type.text", "id"]
+
+SCAN_PROJECTION = {"id": 1, "location_name.text": 1, "alias": 1, "location": 1}
+
+# 削除するレコードから補わないフィールド（処理の状態や更新スケジュールは残すレコードのものを使う）
+NOT_FILLED_FIELDS = {
+    "_id", "aliases", LEASES_FIELD, PENDING_FIELD, CONTENT_HASH_FIELD, FAILURE_COUNT_FIELD,
+    "fetchedAt", "nextRefreshAt", "lastRefreshFailedAt",
+}
+
+
+class UnionFind:
+    """重複グループをまとめる素集合データ構造"""
+
+    def __init__(self):
+        self.parent = {}
+        self.reasons = defaultdict(set)
+
+    def find(self, key):
+        self.parent.setdefault(key, key)
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    def union(self, a, b, reason):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+            self.reasons[root_a] |= self.reasons.pop(root_b, set())
+        self.reasons[root_a].add(reason)
+
+    def groups(self):
+        members = defaultdict(list)
+        for key in self.parent:
+            members[self.find(key)].append(key)
+        return [(group, self.reasons[root]) for root, group in members.items() if len(group) > 1]
+
+
+def _get(record, dotted):
+    value = record
+    for key in dotted.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _cell(latitude, longitude, step):
+    return math.floor(latitude / step), math.floor(longitude / step)
+
+
+def find_duplicate_groups(records, radius=DEFAULT_RADIUS):
+    """place ID、または正規化した名前が同じで半径radius以内にあるレコードをグループにまとめる
+
+    名前と位置はグリッドに振り分け、同じ名前の近傍セルだけを比較するため
+    件数に対してほぼ線形の時間で終わる。戻り値は [(_idのリスト, 理由の集合)]。
+    """
+    union_find = UnionFind()
+    by_id = {}
+    # (正規化した名前, セル) -> [(_id, 緯度, 経度)]
+    grid = defaultdict(list)
+    step = radius / 111320  # 緯度1度は約111.32km
+
+    for record in records:
+        key = record["_id"]
+        union_find.find(key)
+
+        place_id = record.get("id")
+        if place_id:
+            if place_id in by_id:
+                union_find.union(by_id[place_id], key, "id")
+            else:
+                by_id[place_id] = key
+
+        location = record.get("location") or {}
+        latitude, longitude = location.get("latitude"), location.get("longitude")
+        if latitude is None or longitude is None:
+            continue
+        names = {normalize_name(_get(record, "location_name.text")), normalize_name(record.get("alias"))}
+        names.discard("")
+
+        # 経度1度の距離は緯度によって縮むため、経度方向は余分にセルを調べる
+        lng_reach = math.ceil(1 / max(math.cos(math.radians(min(abs(latitude) + step, 89))), 0.01))
+        row, column = _cell(latitude, longitude, step)
+        for name in names:
+            for d_row in (-1, 0, 1):
+                for d_column in range(-lng_reach, lng_reach + 1):
+                    for other, other_lat, other_lng in grid.get((name, (row + d_row, column + d_column)), ()):
+                        if distance_meters(latitude, longitude, other_lat, other_lng) <= radius:
+                            union_find.union(other, key, "name_proximity")
+            grid[(name, (row, column))].append((key, latitude, longitude))
+
+    return union_find.groups()
+
+
+def _completeness(record):
+    """代表レコードを選ぶための情報量（営業時間の有無、値のあるフィールド数。処理の状態は数えない）"""
+    has_hours = bool(record.get("openingHours") or record.get("currentOpeningHours"))
+    return has_hours, sum(1 for key, value in record.items()
+                          if key not in NOT_FILLED_FIELDS and value not in (None, "", [], {}))
+
+
+def plan_merge(records, reasons):
+    """重複グループの統合内容を作る
+
+    情報量の多いレコードを残し、他のレコードの別名をaliasesに集め、
+    残すレコードにないフィールドだけを補う（リースや更新スケジュールなどNOT_FILLED_FIELDSは除く）。
+    食い違う値は残すレコードの値を優先して報告する。
+    異なるplace IDを持つレコードを含むグループは別の店舗（近くの系列店など）の可能性があるため、
+    自動では統合しない（needs_review）。
+    """
+    keeper = max(records, key=lambda record: (_completeness(record), -records.index(record)))
+    others = [record for record in records if record is not keeper]
+
+    keeper_name = _get(keeper, "location_name.text")
+    aliases = []
+    for record in [keeper] + others:
+        for alias in [record.get("alias"), _get(record, "location_name.text")] + list(record.get("aliases") or []):
+            if alias and alias != keeper_name and alias not in aliases:
+                aliases.append(alias)
+
+    fill = {}
+    for record in others:
+        for key, value in record.items():
+            if key in NOT_FILLED_FIELDS or value in (None, "", [], {}):
+                continue
+            if keeper.get(key) in (None, "", [], {}) and key not in fill:
+                fill[key] = value
+
+    conflicts = []
+    for field in CONFLICT_FIELDS:
+        values = []
+        for record in records:
+            value = _get(record, field)
+            if value is not None and value not in values:
+                values.append(value)
+        if len(values) > 1:
+            conflicts.append({"field": field, "kept": _get(keeper, field), "values": values})
+
+    place_ids = {record.get("id") for record in records if record.get("id")}
+
+    return {
+        "keeper": keeper["_id"],
+        "needs_review": len(place_ids) > 1,
+        "removed": [record["_id"] for record in others],
+        "reasons": sorted(reasons),
+        "names": [_get(record, "location_name.text") for record in records],
+        "aliases": aliases,
+        "fill": fill,
+        "conflicts": conflicts,
+    }
+
+
+def merge_operations(plan):
+    """統合内容をbulk_writeの操作に変換する"""
+    update = {}
+    if plan["fill"]:
+        update["$set"] = plan["fill"]
+    if plan["aliases"]:
+        update["$addToSet"] = {"aliases": {"$each": plan["aliases"]}}
+    operations = [UpdateOne({"_id": plan["keeper"]}, update)] if update else []
+    operations.append(DeleteMany({"_id": {"$in": plan["removed"]}}))
+    return operations
+
+
+def dedup_places(radius=DEFAULT_RADIUS, apply=False, batch_size=500):
+    """重複レコードを検出し、結果を報告する。apply=Trueなら統合して重複を削除する"""
+    client = MongoClient(os.environ.get("MONGODB_ADDRESS"))
+    db = client['places']
+    collection = db['place_info']
+
+    try:
+        total = collection.estimated_document_count()
+        print(f"📊 レコード数: 約{total}件")
+        print(f"🔍 重複を検出しています（半径{radius}m）...")
+        groups = find_duplicate_groups(collection.find({}, SCAN_PROJECTION), radius)
+        print(f"   • 重複グループ: {len(groups)}件（{sum(len(group) for group, _ in groups)}レコード）")
+
+        plans = []
+        operations = []
+        merged = 0
+        removed = 0
+        for group, reasons in groups:
+            records = list(collection.find({"_id": {"$in": group}}).sort("_id", 1))
+            plan = plan_merge(records, reasons)
+            plans.append(plan)
+            for conflict in plan["conflicts"]:
+                print(f"⚠️  {plan['names'][0]}: {conflict['field']} が食い違っています {conflict['values']}")
+            if not apply:
+                continue
+            if plan["needs_review"]:
+                # place IDが異なるものは別の店舗かもしれないため、削除せずに報告だけする
+                print(f"⏭  place IDが異なるため統合しません（要確認）: {plan['names']}")
+                continue
+            operations.extend(merge_operations(plan))
+            merged += 1
+            removed += len(plan["removed"])
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+
+        print(f"\n📊 処理結果:")
+        print(f"   • 重複グループ: {len(plans)}件")
+        print(f"   • 食い違いのあるグループ: {sum(1 for plan in plans if plan['conflicts'])}件")
+        print(f"   • place IDが異なり要確認のグループ: {sum(1 for plan in plans if plan['needs_review'])}件")
+        if apply:
+            print(f"   • 統合したグループ: {merged}件")
+            print(f"   • 削除したレコード: {removed}件")
+        else:
+            print("   • --apply を指定すると統合します")
+
+        if plans:
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            filename = f"duplicate_places_{timestamp}.json"
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(plans, f, ensure_ascii=False, indent=2, default=str)
+            print(f"\n💾 重複グループを保存しました: {filename}")
+    finally:
+        client.close()
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='同じ場所を指す重複レコードを検出・統合する')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS,
+                       help=f'同じ名前のレコードを同一店舗とみなす距離（メートル、デフォルト: {DEFAULT_RADIUS}）')
+    parser.add_argument('--apply', action='store_true',
+                       help='重複を統合して削除する（指定しない場合は報告のみ）')
+    parser.add_argument('--batch-size', '-b', type=int, default=500,
+                       help='1回のbulk_writeで送る操作数（デフォルト: 500）')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+    dedup_places(args.radius, args.apply, args.batch_size)
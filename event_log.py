@@ -0,0 +1,56 @@
+import json
+import os
+
+from freshness import utcnow
+
+# 状態の変化を追記するファイル（環境変数PLACES_EVENT_LOGで上書きできる）
+DEFAULT_EVENT_LOG = "place_events.jsonl"
+
+
+def default_event_log_path():
+    """環境変数の設定に従ってイベントログのパスを返す（load_dotenvの後に読むため呼び出し時に参照する）"""
+    return os.environ.get("PLACES_EVENT_LOG", DEFAULT_EVENT_LOG)
+
+
+class EventLog:
+    """営業状態や営業時間の変化を1行1件のJSONとして発生時に追記する
+
+    各イベントはO_APPENDで開いたファイルへの1回のwriteで書き込むため、
+    途中でプロセスが止まっても書き込み済みのイベントは失われず、
+    複数のプロセスが同じファイルに追記しても行が混ざらない。ファイルは最初のイベントで開く。
+    pathを省略した場合はdefault_event_log_path()を使う。
+    """
+
+    def __init__(self, path=None, script=None):
+        self.path = path or default_event_log_path()
+        self.script = script
+        self.count = 0
+        self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def append(self, event_type, record, **fields):
+        """recordに関するイベントを追記する"""
+        event = {
+            "at": utcnow().isoformat(),
+            "script": self.script,
+            "type": event_type,
+            "place_id": record.get('id'),
+            "name": (record.get('location_name') or {}).get('text'),
+            "alias": record.get('alias'),
+            **fields,
+        }
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+        self.count += 1
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+
+# フィールドごとの再取得間隔
+REFRESH_INTERVALS = {
+    "businessStatus": timedelta(days=14),
+    "currentOpeningHours": timedelta(days=7),
+}
+
+# 取得に失敗したレコードを次に試すまでの間隔（失敗が続くたびに倍にする）と上限
+FAILURE_BACKOFF = timedelta(hours=1)
+FAILURE_BACKOFF_MAX = timedelta(days=7)
+
+# 連続して取得に失敗した回数を記録するフィールド
+FAILURE_COUNT_FIELD = "refreshFailures"
+
+# 一度も取得していないフィールドの取得日時として扱う値
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _as_aware(value):
+    """MongoDBから読んだnaiveなdatetimeをUTCとして扱う"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def stale_fields(record, now=None):
+    """再取得間隔を過ぎたAPIフィールドのリストを返す。永久閉店の場所は対象外"""
+    if record.get('businessStatus') == "CLOSED_PERMANENTLY":
+        return []
+    now = now or utcnow()
+    fetched_at = record.get('fetchedAt') or {}
+    return [
+        field for field, interval in REFRESH_INTERVALS.items()
+        if (_as_aware(fetched_at.get(field)) or EPOCH) + interval <= now
+    ]
+
+
+def freshness_update(record, fields, now=None, closed=None):
+    """取得したフィールドの取得日時と次回更新日時を$set用の辞書で返す
+
+    closedを省略した場合はrecordのbusinessStatusが永久閉店かどうかで判断する。
+    """
+    now = now or utcnow()
+    if closed is None:
+        closed = (record or {}).get('businessStatus') == "CLOSED_PERMANENTLY"
+    fetched_at = {key: _as_aware(value) for key, value in ((record or {}).get('fetchedAt') or {}).items()}
+    update = {}
+    for field in fields:
+        fetched_at[field] = now
+        update[f"fetchedAt.{field}"] = now
+
+    if closed:
+        # 永久閉店の場所は以降スケジュールしない
+        update["nextRefreshAt"] = None
+    else:
+        update["nextRefreshAt"] = min(
+            (fetched_at.get(field) or EPOCH) + interval
+            for field, interval in REFRESH_INTERVALS.items()
+        )
+    return update
+
+
+def failure_update(record, now=None):
+    """取得に失敗したレコードの失敗回数を増やし、次回更新日時をバックオフ分だけ先に送る$set用の辞書を返す
+
+    次回更新日時を据え置くと、古い順に選ぶdue_recordsが毎回同じ失敗レコードから取り出してしまう。
+    """
+    now = now or utcnow()
+    failures = (record.get(FAILURE_COUNT_FIELD) or 0) + 1
+    backoff = min(FAILURE_BACKOFF * (2 ** min(failures - 1, 16)), FAILURE_BACKOFF_MAX)
+    return {
+        FAILURE_COUNT_FIELD: failures,
+        "lastRefreshFailedAt": now,
+        "nextRefreshAt": now + backoff,
+    }
+
+
+def ensure_refresh_indexes(collection):
+    """スケジューラが使うインデックスを作成する"""
+    collection.create_index("nextRefreshAt")
+    collection.create_index([("category", 1), ("nextRefreshAt", 1)])
+
+
+def backfill_next_refresh(collection):
+    """nextRefreshAtを持たない既存レコードを即時更新対象として登録する"""
+    result = collection.update_many(
+        {"nextRefreshAt": {"$exists": False}, "businessStatus": {"$ne": "CLOSED_PERMANENTLY"}},
+        {"$set": {"nextRefreshAt": EPOCH}}
+    )
+    return result.modified_count
+
+
+def due_query(now=None):
+    """次回更新日時を過ぎたレコードの検索条件。永久閉店の場所は次回更新日時が残っていても含めない"""
+    return {"nextRefreshAt": {"$lte": now or utcnow()}, "businessStatus": {"$ne": "CLOSED_PERMANENTLY"}}
+
+
+def due_records(collection, budget, priority_categories=None, now=None, projection=None):
+    """次回更新日時を過ぎたレコードを古い順に最大budget件返す。優先カテゴリを先に選ぶ
+
+    永久閉店の場所は選ばない（APIを呼ばずに予算だけを使ってしまうため）。
+    """
+    due = due_query(now)
+    tiers = []
+    if priority_categories:
+        tiers.append({**due, "category": {"$in": list(priority_categories)}})
+        tiers.append({**due, "category": {"$nin": list(priority_categories)}})
+    else:
+        tiers.append(due)
+
+    remaining = budget
+    for query in tiers:
+        if remaining <= 0:
+            break
+        cursor = collection.find(query, projection).sort("nextRefreshAt", 1).limit(remaining)
+        for record in cursor:
+            remaining -= 1
+            yield record
@@ -0,0 +1,85 @@
+from opening_intervals import open_at_query
+
+# GeoJSON Pointを保存するフィールド名
+GEO_FIELD = "geo_point"
+
+
+def to_geo_point(location):
+    """Places APIの {latitude, longitude} をGeoJSONのPointに変換する。座標がなければNone"""
+    if not location:
+        return None
+    latitude = location.get('latitude')
+    longitude = location.get('longitude')
+    if latitude is None or longitude is None:
+        return None
+    # GeoJSONは [経度, 緯度] の順
+    return {"type": "Point", "coordinates": [float(longitude), float(latitude)]}
+
+
+def ensure_geo_index(collection):
+    """geo_pointの2dsphereインデックスと、カテゴリ絞り込み用の複合インデックスを作成する"""
+    collection.create_index([(GEO_FIELD, "2dsphere")])
+    collection.create_index([("category", 1), (GEO_FIELD, "2dsphere")])
+
+
+def backfill_geo_points(collection, batch_size=1000):
+    """geo_pointを持たない既存レコードにlocationから変換した値を書き込む。更新件数を返す"""
+    from pymongo import UpdateOne
+
+    cursor = collection.find(
+        {GEO_FIELD: {"$exists": False}, "location.latitude": {"$exists": True}},
+        {"location": 1}
+    ).batch_size(batch_size)
+
+    updated = 0
+    operations = []
+    for record in cursor:
+        geo_point = to_geo_point(record.get('location'))
+        if geo_point is None:
+            continue
+        operations.append(UpdateOne({"_id": record["_id"]}, {"$set": {GEO_FIELD: geo_point}}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def nearby_query(categories=None, primary_types=None, open_at=None, include_closed=False):
+    """近傍検索に付ける絞り込み条件を返す"""
+    query = {}
+    if not include_closed:
+        query["businessStatus"] = {"$ne": "CLOSED_PERMANENTLY"}
+    if categories:
+        query["category"] = {"$in": list(categories)}
+    if primary_types:
+        query["primary_type.text"] = {"$in": list(primary_types)}
+    if open_at is not None:
+        query.update(open_at_query(open_at))
+    return query
+
+
+def find_nearby(collection, latitude, longitude, max_distance=2000, categories=None,
+                primary_types=None, open_at=None, limit=100, projection=None):
+    """指定地点からmax_distanceメートル以内の場所を近い順に返す
+
+    各レコードには地点からの距離（メートル）がdistanceとして付く。
+    open_atを指定するとその日時に営業している場所（openIntervals）だけに絞り込む。
+    """
+    pipeline = [
+        {
+            "$geoNear": {
+                "near": {"type": "Point", "coordinates": [float(longitude), float(latitude)]},
+                "distanceField": "distance",
+                "maxDistance": max_distance,
+                "query": nearby_query(categories, primary_types, open_at),
+                "key": GEO_FIELD,
+                "spherical": True,
+            }
+        },
+        {"$limit": limit},
+    ]
+    if projection:
+        pipeline.append({"$project": {**projection, "distance": 1}})
+    return list(collection.aggregate(pipeline))
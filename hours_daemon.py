@@ -0,0 +1,299 @@
+import argparse
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+
+from event_log import EventLog
+from freshness import FAILURE_COUNT_FIELD, ensure_refresh_indexes, utcnow
+from opening_intervals import ensure_open_intervals_index
+from place_document import CONTENT_HASH_FIELD, PENDING_FIELD
+from places_client import PlacesClient
+from places_fetch import PlacesFetcher
+from refresh_places import build_update, get_place_fields, record_changes
+import instrumentation
+from instrumentation import metrics, verbose
+
+# 取得待ちのレコードに対して取得するフィールド
+FIELDS = ["businessStatus", "currentOpeningHours"]
+
+# build_updateが前回の値と比べるフィールド（ハッシュと失敗回数を含む）と、イベントログに書くフィールド
+RECORD_PROJECTION = {
+    "id": 1, "location_name.text": 1, "alias": 1, "businessStatus": 1, "openingHours": 1,
+    "openingHoursStatus": 1, "openIntervals": 1, "fetchedAt": 1, PENDING_FIELD: 1,
+    CONTENT_HASH_FIELD: 1, FAILURE_COUNT_FIELD: 1,
+}
+
+# 取得待ちフラグが立ったレコードの挿入・更新だけを受け取る
+CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace"]}, f"fullDocument.{PENDING_FIELD}": True},
+        {"operationType": "update", f"updateDescription.updatedFields.{PENDING_FIELD}": True},
+    ]}}
+]
+
+STATE_ID = "hours_daemon"
+
+# change streamが切断されたときに開き直すまでの待ち時間（秒）と試行回数
+RECONNECT_DELAY = 5.0
+RECONNECT_ATTEMPTS = 5
+
+
+def ensure_pending_index(collection):
+    """取得待ちのレコードだけを対象にした部分インデックスを作成する"""
+    collection.create_index(PENDING_FIELD, partialFilterExpression={PENDING_FIELD: True})
+
+
+class HoursDaemon:
+    """取得待ちフラグの立ったレコードの営業時間と営業状態を取得して書き込み続ける
+
+    レプリカセットではplace_infoのchange streamを購読し、使えない場合は
+    取得待ちフラグの部分インデックスを定期的にポーリングする。
+    通知されたレコードはcoalesce秒またはbatch_size件ごとにまとめて処理する。
+    change streamが切断された場合は保存した再開トークンから開き直し、
+    開き直せなければポーリングに切り替える。MongoDBの読み書きに失敗したレコードは
+    取得待ちのまま残し、次の取り残し処理で取得し直す。
+    営業状態と営業時間の変化は、書き込みが成功した後にevent_logへ追記する。
+    """
+
+    def __init__(self, collection, state, api_key, concurrency=4, rate=10.0,
+                 batch_size=20, coalesce=2.0, poll_interval=5.0, event_log=None):
+        self.collection = collection
+        self.state = state
+        self.batch_size = batch_size
+        self.coalesce = coalesce
+        self.poll_interval = poll_interval
+        self.fetcher = PlacesFetcher(concurrency=concurrency, rate=rate)
+        self.places_client = PlacesClient(api_key, self.fetcher)
+        self.event_log = event_log or EventLog(script="hours_daemon")
+        self.processed_count = 0
+        self.failed_count = 0
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._stream_error = None
+        self._retry_pending = False
+
+    def stop(self):
+        self._stop.set()
+
+    def _load_resume_token(self):
+        return (self.state.find_one({"_id": STATE_ID}) or {}).get("resume_token")
+
+    def _save_resume_token(self, token):
+        self.state.update_one({"_id": STATE_ID}, {"$set": {"resume_token": token}}, upsert=True)
+
+    def _watch(self, stream):
+        """change streamの通知を(_id, 再開トークン)としてキューに積む"""
+        try:
+            while not self._stop.is_set():
+                change = stream.try_next()
+                if change is None:
+                    continue
+                self._queue.put((change["documentKey"]["_id"], change["_id"]))
+        except PyMongoError as e:
+            print(f"❌ change streamが切断されました: {str(e)}")
+            self._stream_error = e
+        finally:
+            self._queue.put(None)
+
+    def open_stream(self):
+        """change streamを開く。レプリカセットでない場合はNone"""
+        token = self._load_resume_token()
+        try:
+            return self.collection.watch(CHANGE_PIPELINE, resume_after=token, max_await_time_ms=1000)
+        except OperationFailure as e:
+            if token is None:
+                print(f"⚠️  change streamを利用できません（ポーリングに切り替えます）: {e.details.get('errmsg', str(e))}")
+                return None
+            # 再開トークンが古くなっている場合は、最初の取り残し処理で補う
+            print("⚠️  前回の続きから再開できないため、新しくchange streamを開きます")
+            self.state.update_one({"_id": STATE_ID}, {"$unset": {"resume_token": ""}})
+            return self.open_stream()
+
+    def process(self, ids=None):
+        """取得待ちのレコードを取得して書き込む。idsを省略した場合は取得待ちのものから最大batch_size件"""
+        query = {PENDING_FIELD: True}
+        if ids is not None:
+            query["_id"] = {"$in": list(ids)}
+        try:
+            with metrics.stage("mongo_read"):
+                records = list(self.collection.find(query, RECORD_PROJECTION).limit(self.batch_size))
+        except PyMongoError as e:
+            print(f"❌ 取得待ちのレコードを読み込めませんでした: {str(e)}")
+            metrics.incr("mongo_error")
+            self._retry_pending = True
+            return 0
+        if not records:
+            return 0
+
+        def fetch(record):
+            if not record.get('id'):
+                return None
+            return get_place_fields(record['id'], FIELDS, self.places_client)
+
+        now = utcnow()
+        operations = []
+        changes = []
+        refreshed_count = 0
+        for record, result in self.fetcher.map_unordered(fetch, records):
+            location_name = record.get('location_name', {}).get('text', 'N/A')
+            if result is None:
+                # 取得できなかったレコードはフラグだけ下ろし、refresh_places.pyの定期更新に任せる
+                print(f"⚠ 取得失敗: {location_name}")
+                self.failed_count += 1
+                metrics.incr("fetch_failed")
+                operations.append(UpdateOne({"_id": record["_id"]}, {"$set": {PENDING_FIELD: False}}))
+                continue
+            update = build_update(record, FIELDS, result, now)
+            update[PENDING_FIELD] = False
+            operations.append(UpdateOne({"_id": record["_id"]}, {"$set": update}))
+            changes.append((record, update))
+            refreshed_count += 1
+            verbose(f"✓ 更新: {location_name} ({result.get('businessStatus', 'N/A')})")
+
+        try:
+            with metrics.stage("mongo_write"):
+                self.collection.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            # 取得待ちフラグは立ったままなので、次の取り残し処理で取得し直す
+            print(f"❌ {len(operations)}件の書き込みに失敗しました（次回に再試行します）: {str(e)}")
+            metrics.incr("write_failed", len(operations))
+            self._retry_pending = True
+            return 0
+        self.processed_count += refreshed_count
+        metrics.incr("refreshed", refreshed_count)
+        for record, update in changes:
+            record_changes(self.event_log, record, update)
+        print(f"📝 {len(operations)}件を更新しました（累計: 成功 {self.processed_count}件 / 失敗 {self.failed_count}件）")
+        return len(records)
+
+    def drain_pending(self):
+        """取得待ちのまま残っているレコードがなくなるまで処理する"""
+        self._retry_pending = False
+        while not self._stop.is_set() and self.process() == self.batch_size:
+            pass
+
+    def _next_batch(self):
+        """最初の通知からcoalesce秒待つか、batch_size件たまるまで通知をまとめる"""
+        ids = set()
+        token = None
+        item = self._queue.get()
+        deadline = time.monotonic() + self.coalesce
+        while item is not None:
+            doc_id, token = item
+            ids.add(doc_id)
+            remaining = deadline - time.monotonic()
+            if len(ids) >= self.batch_size or remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return ids, token, item is None
+
+    def run_stream(self, stream):
+        """change streamの通知を処理する。切断された場合はTrueを返す"""
+        self._stream_error = None
+        watcher = threading.Thread(target=self._watch, args=(stream,), daemon=True)
+        watcher.start()
+        # 購読を始めてから、停止中に登録されたレコードを処理する
+        self.drain_pending()
+        print("👀 change streamで新しいレコードを待っています...")
+        while not self._stop.is_set():
+            ids, token, closed = self._next_batch()
+            if ids:
+                self.process(ids)
+            if self._retry_pending:
+                self.drain_pending()
+            if token is not None:
+                try:
+                    self._save_resume_token(token)
+                except PyMongoError as e:
+                    print(f"⚠️  再開トークンを保存できませんでした: {str(e)}")
+            if closed:
+                break
+        stream.close()
+        return self._stream_error is not None
+
+    def reopen_stream(self):
+        """切断されたchange streamを保存した再開トークンから開き直す。開けなければNone"""
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            if self._stop.wait(RECONNECT_DELAY):
+                return None
+            print(f"🔁 change streamを開き直しています（{attempt}/{RECONNECT_ATTEMPTS}回目）...")
+            try:
+                return self.open_stream()
+            except PyMongoError as e:
+                print(f"⚠️  change streamを開けませんでした: {str(e)}")
+        return None
+
+    def run_polling(self):
+        print(f"👀 {self.poll_interval}秒ごとに取得待ちのレコードを確認しています...")
+        while not self._stop.is_set():
+            self.drain_pending()
+            self._stop.wait(self.poll_interval)
+
+    def run(self, mode="auto"):
+        stream = self.open_stream() if mode != "poll" else None
+        if stream is None and mode == "stream":
+            raise RuntimeError("change streamを開けませんでした")
+        while stream is not None:
+            if not self.run_stream(stream) or self._stop.is_set():
+                return
+            stream = self.reopen_stream()
+        if not self._stop.is_set():
+            self.run_polling()
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='新しく登録された場所の営業時間と営業状態を取得し続ける')
+    parser.add_argument('--mode', choices=['auto', 'stream', 'poll'], default='auto',
+                       help='auto: change streamが使えなければポーリング（デフォルト）')
+    parser.add_argument('--batch-size', '-b', type=int, default=20,
+                       help='まとめて処理する最大件数（デフォルト: 20）')
+    parser.add_argument('--coalesce', type=float, default=2.0,
+                       help='通知をまとめるために待つ秒数（デフォルト: 2.0）')
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                       help='ポーリング時の確認間隔（秒、デフォルト: 5.0）')
+    parser.add_argument('--concurrency', '-n', type=int, default=4,
+                       help='Places APIへの同時リクエスト数（デフォルト: 4）')
+    parser.add_argument('--rate', '-r', type=float, default=10.0,
+                       help='1秒あたりの最大APIリクエスト数（デフォルト: 10）')
+    parser.add_argument('--event-log',
+                       help='営業状態と営業時間の変化を追記するファイル（デフォルト: 環境変数PLACES_EVENT_LOG、なければplace_events.jsonl）')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+    instrumentation.set_verbosity(args.verbose)
+    metrics.script = "hours_daemon"
+
+    client = MongoClient(os.environ["MONGODB_ADDRESS"])
+    db = client.places
+    collection = db.place_info
+    ensure_pending_index(collection)
+    ensure_refresh_indexes(collection)
+    ensure_open_intervals_index(collection)
+
+    event_log = EventLog(args.event_log, "hours_daemon")
+    daemon = HoursDaemon(collection, db.daemon_state, os.environ["GOOGLE_MAPS_API_KEY"],
+                         args.concurrency, args.rate, args.batch_size, args.coalesce, args.poll_interval,
+                         event_log)
+    try:
+        daemon.run(args.mode)
+    except KeyboardInterrupt:
+        print("\n処理を中断します")
+    finally:
+        daemon.stop()
+        event_log.close()
+        client.close()
+        if args.metrics_file:
+            metrics.write(args.metrics_file, args.metrics_format)
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import sqlite3
+
+DEFAULT_PATH = ".import_journal.sqlite3"
+
+
+def row_hash(*values):
+    """CSVの行を識別するハッシュを返す"""
+    raw = json.dumps(values, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ImportJournal:
+    """CSVごとに処理済みの行を記録し、中断後の再実行で処理済みの行を飛ばすための進捗記録"""
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=50):
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completed_rows ("
+            " csv_file TEXT NOT NULL, row_hash TEXT NOT NULL,"
+            " PRIMARY KEY (csv_file, row_hash))"
+        )
+        self._conn.commit()
+        self._pending = []
+
+    def completed(self, csv_file):
+        """CSVファイルの処理済み行ハッシュの集合を返す"""
+        rows = self._conn.execute(
+            "SELECT row_hash FROM completed_rows WHERE csv_file = ?", (csv_file,)
+        )
+        return {row[0] for row in rows}
+
+    def mark_done(self, csv_file, hash_value):
+        """行を処理済みとして記録する。batch_size件たまるごとにコミットする"""
+        self._pending.append((csv_file, hash_value))
+        if len(self._pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        if not self._pending:
+            return
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO completed_rows (csv_file, row_hash) VALUES (?, ?)",
+            self._pending,
+        )
+        self._conn.commit()
+        self._pending = []
+
+    def reset(self, csv_file=None):
+        """記録を消去する。csv_fileを指定した場合はそのファイルの分だけ消去する"""
+        if csv_file is None:
+            self._conn.execute("DELETE FROM completed_rows")
+        else:
+            self._conn.execute("DELETE FROM completed_rows WHERE csv_file = ?", (csv_file,))
+        self._conn.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -0,0 +1,204 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# 段階ごとに保持する所要時間のサンプル数（パーセンタイル計算用）
+RESERVOIR_SIZE = 10000
+
+QUANTILES = (0.5, 0.99)
+
+_verbosity = 0
+
+
+def set_verbosity(level):
+    """レコード単位の出力を表示する詳細度を設定する"""
+    global _verbosity
+    _verbosity = level
+
+
+def verbose(message, level=1):
+    """詳細度がlevel以上の場合だけ出力する"""
+    if _verbosity >= level:
+        print(message)
+
+
+class StageTimer:
+    """1つの段階の所要時間を集計する"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        else:
+            index = random.randrange(self.count)
+            if index < RESERVOIR_SIZE:
+                self.samples[index] = seconds
+
+    def merge(self, other):
+        """別プロセスで集計した同じ段階の結果を合算する"""
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.samples = (self.samples + other.samples)[:RESERVOIR_SIZE]
+
+    def quantile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            **{f"p{int(q * 100)}": self.quantile(q) for q in QUANTILES},
+        }
+
+
+class Metrics:
+    """HTTP取得・JSONデコード・Mongo読み込み・Mongo書き込みの段階別計測とAPI呼び出し数の集計"""
+
+    def __init__(self, script=None):
+        self.script = script
+        self.started_at = time.time()
+        self.stages = defaultdict(StageTimer)
+        self.api_calls = Counter()
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].add(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """with文の中の処理時間をnameの段階として記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        """イテレータから1件取り出すごとの時間をnameの段階として記録する"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.record(name, time.perf_counter() - start)
+            yield item
+
+    def count_api_call(self, field_mask, status):
+        """フィールドマスクとステータスコードごとにAPI呼び出し数を数える"""
+        with self._lock:
+            self.api_calls[(field_mask, status)] += 1
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.api_calls.clear()
+            self.counters.clear()
+
+    def state(self):
+        """別プロセスに渡せる形で集計結果を返す"""
+        with self._lock:
+            return {
+                "stages": dict(self.stages),
+                "api_calls": Counter(self.api_calls),
+                "counters": Counter(self.counters),
+            }
+
+    def merge(self, state):
+        """state()で受け取った別プロセスの集計結果を合算する"""
+        with self._lock:
+            for name, timer in state["stages"].items():
+                self.stages[name].merge(timer)
+            self.api_calls.update(state["api_calls"])
+            self.counters.update(state["counters"])
+
+    def summary(self):
+        with self._lock:
+            return {
+                "script": self.script,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "elapsed": time.time() - self.started_at,
+                "stages": {name: timer.summary() for name, timer in sorted(self.stages.items())},
+                "api_calls": [
+                    {"field_mask": field_mask, "status": status, "count": count}
+                    for (field_mask, status), count in sorted(self.api_calls.items(), key=str)
+                ],
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self):
+        """Prometheusのテキスト形式で出力する"""
+        summary = self.summary()
+        script = _label(summary["script"] or "")
+        lines = [
+            "# TYPE places_stage_seconds summary",
+        ]
+        for stage, values in summary["stages"].items():
+            labels = f'script="{script}",stage="{_label(stage)}"'
+            for q in QUANTILES:
+                lines.append(f'places_stage_seconds{{{labels},quantile="{q}"}} {values[f"p{int(q * 100)}"]}')
+            lines.append(f"places_stage_seconds_sum{{{labels}}} {values['sum']}")
+            lines.append(f"places_stage_seconds_count{{{labels}}} {values['count']}")
+        lines.append("# TYPE places_api_calls_total counter")
+        for call in summary["api_calls"]:
+            lines.append(
+                f'places_api_calls_total{{script="{script}",field_mask="{_label(call["field_mask"])}",'
+                f'status="{call["status"]}"}} {call["count"]}'
+            )
+        lines.append("# TYPE places_records_total counter")
+        for name, count in summary["counters"].items():
+            lines.append(f'places_records_total{{script="{script}",result="{_label(name)}"}} {count}')
+        lines.append(f'places_run_seconds{{script="{script}"}} {summary["elapsed"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, format="jsonl"):
+        """集計結果をファイルに書き出す。jsonlは追記、prometheusは上書き"""
+        if format == "prometheus":
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(self.to_prometheus())
+        else:
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(self.summary(), ensure_ascii=False) + "\n")
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def add_arguments(parser):
+    """詳細度とメトリクス出力のコマンドライン引数を追加する"""
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+                       help='レコード単位の進捗を表示する')
+    parser.add_argument('--metrics-file',
+                       help='段階別の所要時間とAPI呼び出し数を書き出すファイル')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl',
+                       help='メトリクスの出力形式（デフォルト: jsonl）')
+
+
+# プロセス全体で共有する計測結果
+metrics = Metrics()
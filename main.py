@@ -1,146 +1,217 @@
 import os
-import pandas as pd
-import requests
 import json
-import time
 import argparse
 from dotenv import load_dotenv
 # from urllib.parse import unquote
-from pymongo import MongoClient
 import csv
+import io
+import difflib
+from itertools import islice
+import import_journal
+from freshness import freshness_update, utcnow
+from place_document import build_place_document, opening_hours_fields
+from place_matching import distance_meters, normalize_name
+import instrumentation
+from instrumentation import metrics, verbose
 
 # Category constants
 CAT_INSIDE_OK = 1
 CAT_TERRACE_OK = 2
 CAT_FAV_DOG_NG = 3
 
-load_dotenv()
+# 一括解決モードで候補として優先する種類（primaryTypeDisplayName）のキーワード
+FOOD_TYPE_KEYWORDS = ('カフェ', '喫茶', 'コーヒー', 'レストラン', '料理', '食堂', 'ベーカリー', 'パン',
+                      'ケーキ', 'スイーツ', 'バー', '居酒屋', 'ラーメン', 'cafe', 'coffee', 'restaurant', 'bakery')
 
+# 一括解決モードで自動採用するスコアの下限と、2位との最低スコア差
+DEFAULT_CONFIDENCE_THRESHOLD = 0.75
+AMBIGUITY_MARGIN = 0.1
 
-def get_place_id(location_name, cat_num, api_key):
-    """Google Places API から候補を取得し、利用者に選択させる"""
+# Places APIクライアント（最初に使うときに作成し、接続を使い回す）
+_places_client = None
 
-    url = "https://places.googleapis.com/v1/places:searchText"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-FieldMask": "places.displayName,places.primaryTypeDisplayName,places.googleMapsUri,places.id,places.location,places.formattedAddress,places.businessStatus",
-        "X-Goog-Api-Key": api_key,
-    }
+class PlaceLookupError(Exception):
+    """Places APIの呼び出しに失敗し、場所を判断できなかった（再実行で処理し直す）"""
+
+class PlaceLookupSkipped(Exception):
+    """利用者が候補の選択をスキップ・キャンセルした（再実行で改めて選択する）"""
+
+def get_places_client(api_key):
+    """Places APIクライアントを返す"""
+    global _places_client
+    if _places_client is None:
+        from places_client import PlacesClient
+        _places_client = PlacesClient(api_key)
+    return _places_client
+
+def search_places(location_name, api_key, location_bias=None):
+    """Google Places API のテキスト検索で候補を取得する"""
+    from places_client import PlacesApiError
+    try:
+        return get_places_client(api_key).search_text(location_name, location_bias=location_bias)
+    except PlacesApiError as e:
+        print(f"エラー: {str(e)}")
+        return None
 
-    payload = {
-        "textQuery": location_name,
-        "languageCode": "ja",
-        "maxResultCount": 20
+def print_candidates(location_name, places):
+    """検索結果の候補一覧を表示する"""
+    print(f"\n--- {location_name} の検索結果 ---")
+    for i, place in enumerate(places, start=1):
+        display_name = place.get('displayName', {}).get('text', 'N/A')
+        primary_type = place.get('primaryTypeDisplayName', {}).get('text', 'N/A')
+        address = place.get('formattedAddress', 'N/A')
+        business_status = place.get('businessStatus', 'N/A')
+
+        name_type = f"{display_name} ({primary_type})"
+        print(f"{i:2d}. {name_type}")
+        print(f"    {address} [状態: {business_status}]")
+    print("-" * 100)
+
+def choose_place_interactively(location_name, places):
+    """候補を表示して利用者に選択させる。スキップ・キャンセル時はNone"""
+    print_candidates(location_name, places)
+    print("s. スキップ（この場所を飛ばす）")
+    print("q. キャンセル")
+
+    while True:
+        try:
+            choice = input(f"選択してください (1-{len(places)}, s/q): ").strip().lower()
+        except (KeyboardInterrupt, EOFError):
+            print("\n処理を中断します")
+            return None
+
+        if choice == 's':
+            print("✓ スキップします")
+            return None
+        elif choice == 'q':
+            print("✓ キャンセルしました")
+            return None
+        else:
+            try:
+                choice_num = int(choice)
+                if 1 <= choice_num <= len(places):
+                    selected_place = places[choice_num - 1]
+                    selected_name = selected_place.get('displayName', {}).get('text', 'N/A')
+                    print(f"✓ 選択されました: {selected_name}")
+                    return selected_place
+                else:
+                    print(f"1から{len(places)}の数字を入力してください")
+            except ValueError:
+                print("有効な選択肢を入力してください")
+
+def score_candidate(location_name, place, location_bias=None):
+    """候補が検索語に一致する確からしさを0〜1で返す"""
+    display_name = normalize_name(place.get('displayName', {}).get('text'))
+    alias = normalize_name(location_name)
+    similarity = difflib.SequenceMatcher(None, alias, display_name).ratio()
+    if alias and display_name and (alias in display_name or display_name in alias):
+        similarity = max(similarity, 0.9)
+
+    primary_type = normalize_name(place.get('primaryTypeDisplayName', {}).get('text'))
+    type_score = 1.0 if any(keyword in primary_type for keyword in FOOD_TYPE_KEYWORDS) else 0.0
+
+    if not location_bias:
+        return 0.8 * similarity + 0.2 * type_score
+
+    location = place.get('location') or {}
+    geo_score = 0.0
+    if 'latitude' in location and 'longitude' in location:
+        distance = distance_meters(location_bias["latitude"], location_bias["longitude"],
+                                   location["latitude"], location["longitude"])
+        geo_score = max(0.0, 1.0 - distance / location_bias["radius"])
+    return 0.7 * similarity + 0.15 * type_score + 0.15 * geo_score
+
+def choose_place_automatically(location_name, places, threshold, location_bias=None):
+    """スコアが閾値以上で2位と十分差のある候補を返す。判断できなければ (None, スコア付き候補)"""
+    scored = sorted(((score_candidate(location_name, place, location_bias), place) for place in places),
+                    key=lambda item: item[0], reverse=True)
+    best_score, best_place = scored[0]
+    runner_up = scored[1][0] if len(scored) > 1 else 0.0
+    if best_score >= threshold and best_score - runner_up >= AMBIGUITY_MARGIN:
+        return best_place, scored
+    return None, scored
+
+def append_review_entry(review_file, location_name, cat_num, comment, scored):
+    """判断できなかった候補をレビュー待ちファイルに追記する"""
+    entry = {
+        "alias": location_name,
+        "category": cat_num,
+        "comment": comment,
+        "candidates": [dict(place, score=round(score, 3)) for score, place in scored]
     }
+    with open(review_file, mode='a', encoding='utf-8') as file:
+        file.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    if response.status_code != 200:
-        print(f"エラー: {response.json()}")
+def build_place_info(selected_place, location_name, cat_num):
+    """選択された候補から登録用データを作成する。永久閉店の場合はNone"""
+    # businessStatusをチェック
+    business_status = selected_place.get('businessStatus')
+    if business_status == 'CLOSED_PERMANENTLY':
+        verbose(f"⚠️  {selected_place.get('displayName', {}).get('text', 'N/A')} は永久閉店のため登録しません")
         return None
 
-    result_data = response.json()
-    places = result_data.get("places", [])
+    return build_place_document(selected_place, cat_num, alias=location_name)
+
+def get_place_id(location_name, cat_num, api_key, batch=False, threshold=DEFAULT_CONFIDENCE_THRESHOLD,
+                 location_bias=None, review_file=None, comment=None):
+    """Google Places API から候補を取得し、利用者に選択させる
+
+    batch=True の場合は入力を待たずに候補をスコアで自動選択し、
+    判断できない場合はレビュー待ちファイルに記録してNoneを返す。
+    API呼び出しに失敗した場合はPlaceLookupError、利用者が選択をスキップ・キャンセルした場合は
+    PlaceLookupSkippedを送出する。
+    """
+    places = search_places(location_name, api_key, location_bias)
+    if places is None:
+        raise PlaceLookupError(location_name)
 
     if not places:
-        print("該当する場所が見つかりませんでした")
+        verbose("該当する場所が見つかりませんでした")
         return None
 
     # 検索結果が1件の場合は自動的に選択
-    if len(places) == 1:
+    if len(places) == 1 and not batch:
         selected_place = places[0]
         selected_name = selected_place.get('displayName', {}).get('text', 'N/A')
-        print(f"\n--- {location_name} の検索結果 ---")
+        print_candidates(location_name, places)
         print(f"結果が1件のため、自動的に選択します: {selected_name}")
-        
-        # 場所の詳細情報を表示
-        primary_type = selected_place.get('primaryTypeDisplayName', {}).get('text', 'N/A')
-        address = selected_place.get('formattedAddress', 'N/A')
-        business_status = selected_place.get('businessStatus', 'N/A')
-        
-        name_type = f"{selected_name} ({primary_type})"
-        print(f"1. {name_type}")
-        print(f"    {address} [状態: {business_status}]")
-        print("-" * 100)
+    elif batch:
+        selected_place, scored = choose_place_automatically(location_name, places, threshold, location_bias)
+        if selected_place is None:
+            append_review_entry(review_file, location_name, cat_num, comment, scored)
+            metrics.incr("review_queued")
+            verbose(f"⚠ 候補を判断できないためレビュー待ちに追加しました: {location_name} (最高スコア: {scored[0][0]:.2f})")
+            return None
+        verbose(f"✓ 自動選択されました: {location_name} → "
+                f"{selected_place.get('displayName', {}).get('text', 'N/A')} (スコア: {scored[0][0]:.2f})")
     else:
         # 複数件の場合は従来通りユーザーに選択を求める
-        print(f"\n--- {location_name} の検索結果 ---")
-        for i, place in enumerate(places, start=1):
-            display_name = place.get('displayName', {}).get('text', 'N/A')
-            primary_type = place.get('primaryTypeDisplayName', {}).get('text', 'N/A')
-            address = place.get('formattedAddress', 'N/A')
-            business_status = place.get('businessStatus', 'N/A')
-
-            name_type = f"{display_name} ({primary_type})"
-            print(f"{i:2d}. {name_type}")
-            print(f"    {address} [状態: {business_status}]")
-
-        print("-" * 100)
-        print("s. スキップ（この場所を飛ばす）")
-        print("q. キャンセル")
-
-        while True:
-            choice = input(f"選択してください (1-{len(places)}, s/q): ").strip().lower()
+        selected_place = choose_place_interactively(location_name, places)
+        if selected_place is None:
+            raise PlaceLookupSkipped(location_name)
 
-            if choice == 's':
-                print("✓ スキップします")
-                return None
-            elif choice == 'q':
-                print("✓ キャンセルしました")
-                return None
-            else:
-                try:
-                    choice_num = int(choice)
-                    if 1 <= choice_num <= len(places):
-                        selected_place = places[choice_num - 1]
-                        selected_name = selected_place.get('displayName', {}).get('text', 'N/A')
-                        print(f"✓ 選択されました: {selected_name}")
-                        break
-                    else:
-                        print(f"1から{len(places)}の数字を入力してください")
-                except ValueError:
-                    print("有効な選択肢を入力してください")
-                except KeyboardInterrupt:
-                    print("\n処理を中断します")
-                    return None
-
-    # businessStatusをチェック
-    business_status = selected_place.get('businessStatus')
-    if business_status == 'CLOSED_PERMANENTLY':
-        print(f"⚠️  {selected_place.get('displayName', {}).get('text', 'N/A')} は永久閉店のため登録しません")
-        return None
-
-    return {
-        "id": selected_place.get('id'),
-        "location_name": selected_place.get('displayName'),
-        "primary_type": selected_place.get('primaryTypeDisplayName'),
-        "url": selected_place.get('googleMapsUri'),
-        "location": selected_place.get('location'),
-        "category": cat_num,
-        "alias": location_name,
-        "businessStatus": business_status
-    }
+    return build_place_info(selected_place, location_name, cat_num)
 
 def get_opening_hours(place_id, api_key):
     """営業時間情報を別途取得する関数"""
-    url = f"https://places.googleapis.com/v1/places/{place_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-FieldMask": "currentOpeningHours",
-        "X-Goog-Api-Key": api_key,
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        result = response.json()
-        return result.get('currentOpeningHours')
-    else:
-        print(f"Failed to get opening hours for {place_id}: {response.json()}")
+    from places_client import PlacesApiError
+    try:
+        return get_places_client(api_key).get_place(place_id, ["currentOpeningHours"]).opening_hours
+    except PlacesApiError as e:
+        print(f"Failed to get opening hours for {place_id}: {str(e)}")
         return None
 
-# MongoDB接続設定
+# MongoDB接続設定（インポート時には接続せず、最初に使うときに接続する）
+_collection = None
 
-client = MongoClient(os.environ["MONGODB_ADDRESS"])
-db = client.places
-collection = db.place_info
+def get_collection():
+    """place_infoコレクションを返す。初回呼び出し時にMongoDBへ接続する"""
+    global _collection
+    if _collection is None:
+        from pymongo import MongoClient
+        client = MongoClient(os.environ["MONGODB_ADDRESS"])
+        _collection = client.places.place_info
+    return _collection
 
 # CSVファイルの定義
 csv_files = [
@@ -157,6 +228,23 @@ def parse_arguments():
                        help='処理するカテゴリ番号を指定（1: 犬店内OK, 2: 犬外席OK, 3: お気に入り）')
     parser.add_argument('--list', '-l', action='store_true',
                        help='利用可能なカテゴリの一覧を表示')
+    parser.add_argument('--batch', action='store_true',
+                       help='候補の選択を入力待ちせずスコアで自動判定し、判断できないものはレビュー待ちにする')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_CONFIDENCE_THRESHOLD,
+                       help=f'自動採用するスコアの下限（デフォルト: {DEFAULT_CONFIDENCE_THRESHOLD}）')
+    parser.add_argument('--bias', nargs=3, type=float, metavar=('LAT', 'LNG', 'RADIUS'),
+                       help='検索とスコアに使う地理的な中心（緯度・経度）と半径（メートル）')
+    parser.add_argument('--review-file', default='review_queue.jsonl',
+                       help='レビュー待ちの候補を記録するファイル（デフォルト: review_queue.jsonl）')
+    parser.add_argument('--resolve-review', action='store_true',
+                       help='レビュー待ちファイルの候補を対話的に選択して登録する')
+    parser.add_argument('--journal', default=import_journal.DEFAULT_PATH,
+                       help=f'処理済みの行を記録する進捗ファイル（デフォルト: {import_journal.DEFAULT_PATH}）')
+    parser.add_argument('--reset-journal', action='store_true',
+                       help='進捗記録を消去して最初から処理する')
+    parser.add_argument('--no-snapshot', action='store_true',
+                       help='終了時に地図表示用のスナップショットを書き出さない')
+    instrumentation.add_arguments(parser)
     
     return parser.parse_args()
 
@@ -173,96 +261,395 @@ def get_csv_files_by_categories(specified_categories=None):
     
     return files_to_process
 
-# Google APIキー
-api_key = os.environ["GOOGLE_MAPS_API_KEY"]
+def get_api_key():
+    """Google APIキーを環境変数から取得する"""
+    return os.environ["GOOGLE_MAPS_API_KEY"]
 
-# 出力用CSVファイルの設定
-output_file = 'output.csv'
+class OutputCsv:
+    """出力用CSVファイルを追記モードで一度だけ開き、1行ずつ書き込んでフラッシュする
 
-# 出力用CSVファイルの初期化（ヘッダーを書き込む）
-with open(output_file, mode='w', newline='', encoding='utf-8') as file:
-    writer = csv.writer(file)
-    writer.writerow(['location_name', 'comment', 'url', 'category'])
-
-def check_location_exists(location_name):
-    """Check if a location_name exists in the MongoDB collection by checking both location_name.text and alias fields"""
-    # First check location_name.text
-    result = collection.find_one({"location_name.text": location_name})
-    if result is not None:
-        return True
-    
-    # If not found, check alias field (if it exists)
-    result = collection.find_one({"alias": location_name})
-    return result is not None
+    既存の内容は消さず、ファイルが空の場合だけヘッダーを書き込む。
+    各行は1回のwriteで書き込むため、中断しても行の途中で途切れない。
+    """
 
-# コマンドライン引数を解析
-args = parse_arguments()
+    HEADER = ['location_name', 'comment', 'url', 'category']
 
-# 利用可能なカテゴリ一覧を表示する場合
-if args.list:
-    print("利用可能なカテゴリ:")
-    print(f"  {CAT_INSIDE_OK}: 犬店内（インナーテラス含む）OK飲食店")
-    print(f"  {CAT_TERRACE_OK}: 犬外席OK、散歩途中テイクアウトOK飲食店")
-    print(f"  {CAT_FAV_DOG_NG}: おれたちのモグモグリスト")
-    exit(0)
+    def __init__(self, path):
+        self.path = path
+        self._file = None
 
-# 処理するCSVファイルを決定
-files_to_process = get_csv_files_by_categories(args.categories)
+    def writerow(self, row):
+        if self._file is None:
+            self._file = open(self.path, mode='a', newline='', encoding='utf-8')
+            if self._file.tell() == 0:
+                self._write(self.HEADER)
+        self._write(row)
 
-if not files_to_process:
-    print("処理するカテゴリが指定されていません。すべてのカテゴリを処理します。")
-    files_to_process = csv_files
+    def _write(self, row):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        self._file.write(buffer.getvalue())
+        self._file.flush()
 
-print(f"処理対象カテゴリ数: {len(files_to_process)}件")
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
-# 各CSVファイルを処理
-for csv_file, category in files_to_process:
-    print(f"\n=== 処理中: {csv_file} (カテゴリ: {category}) ===")
+# 出力用CSVファイルの設定（ファイルは最初の書き込み時に開く）
+output_file = 'output.csv'
+output_csv = OutputCsv(output_file)
+
+def ensure_indexes():
+    """存在チェックとupsertで使うフィールドのインデックスを作成し、作成されたことを確認する"""
+    collection = get_collection()
+    collection.create_index("location_name.text")
+    collection.create_index("alias")
+    collection.create_index("aliases")
+    collection.create_index("id")
+
+    indexed_fields = {key for index in collection.index_information().values() for key, _ in index["key"]}
+    missing = {"location_name.text", "alias", "aliases", "id"} - indexed_fields
+    if missing:
+        raise RuntimeError(f"インデックスの作成に失敗しました: {', '.join(sorted(missing))}")
+
+def fetch_existing_location_names(location_names, chunk_size=1000):
+    """location_name.text、alias または統合済みの aliases が一致する名前の集合を $in クエリでまとめて取得する"""
+    collection = get_collection()
+    names = list({name for name in location_names if isinstance(name, str)})
+    existing = set()
+    for start in range(0, len(names), chunk_size):
+        chunk = names[start:start + chunk_size]
+        cursor = collection.find(
+            {"$or": [{"location_name.text": {"$in": chunk}}, {"alias": {"$in": chunk}},
+                     {"aliases": {"$in": chunk}}]},
+            {"location_name.text": 1, "alias": 1, "aliases": 1, "_id": 0}
+        )
+        for doc in metrics.timed_iter("mongo_read", cursor):
+            existing.add(doc.get("location_name", {}).get("text"))
+            existing.add(doc.get("alias"))
+            existing.update(doc.get("aliases") or [])
+    existing.discard(None)
+    return existing
+
+# 存在チェックをまとめて行うCSVの行数
+CSV_CHUNK_SIZE = 1000
+
+def read_csv_rows(csv_file, columns=('タイトル', 'メモ'), report_every=1000, report=True):
+    """CSVを1行ずつ読み、必要な列だけをタプルで返すイテレータを作る
+
+    ヘッダーの検証はここで行うため、ファイルが存在しない・列が足りない場合は
+    呼び出し時点で例外になる。reportがFalseの場合は読み込みの経過を表示しない。
+    """
+    file = open(csv_file, newline='', encoding='utf-8')
+    try:
+        reader = csv.reader(file, quotechar='"', escapechar='\\')
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("ヘッダー行がありません")
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f"必要な列がありません: {', '.join(missing)}")
+    except Exception:
+        file.close()
+        raise
+
+    indices = [header.index(column) for column in columns]
+
+    def iter_rows():
+        rows = 0
+        bad_lines = 0
+        with file:
+            for line in reader:
+                if not line:
+                    continue
+                # 列数が多すぎる行とタイトルが空（列が足りない場合を含む）の行はスキップする
+                if len(line) > len(header) or len(line) <= indices[0] or not line[indices[0]]:
+                    bad_lines += 1
+                    if report:
+                        print(f"⚠ 不正な行をスキップしました: {reader.line_num}行目")
+                    continue
+                rows += 1
+                yield tuple(line[i] if i < len(line) else '' for i in indices)
+                if report and rows % report_every == 0:
+                    print(f"  {rows}件読み込み済み（スキップ: {bad_lines}件）")
+        if report:
+            print(f"CSVファイル読み込み完了: {rows}件のデータ（スキップ: {bad_lines}件）")
+
+    return iter_rows()
+
+def iter_chunks(iterable, size):
+    """イテラブルをsize件ずつのリストに分割する"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+class TitleLookup:
+    """正規化すると同じになるタイトルの行をまとめた1件分の検索
+
+    複数のCSVに同じ場所がある場合、カテゴリはCSVの処理順で最初のものを使い、
+    メモは重複を除いてつなげる。表記の異なるタイトルは別名として登録する。
+    """
+
+    def __init__(self, title):
+        self.title = title.strip()
+        self.titles = []
+        self.categories = []
+        self.comments = []
+        self.rows = []
+
+    def add(self, csv_file, category, title, comment, hash_value):
+        title = title.strip()
+        if title not in self.titles:
+            self.titles.append(title)
+        if category not in self.categories:
+            self.categories.append(category)
+        comment = (comment or '').strip()
+        if comment and comment not in self.comments:
+            self.comments.append(comment)
+        self.rows.append((csv_file, hash_value))
+
+    @property
+    def category(self):
+        return self.categories[0]
+
+    @property
+    def comment(self):
+        return " / ".join(self.comments)
+
+    @property
+    def aliases(self):
+        return [title for title in self.titles if title != self.title]
+
+def iter_pending_rows(files_to_process, journal, report=True):
+    """選択したCSVの行のうち、進捗記録で処理済みでないものを順に返す
+
+    (位置, CSVファイル, カテゴリ, タイトル, メモ, 行ハッシュ) を返す。位置は (ファイル番号, 行番号)。
+    reportがFalseの場合は読み込みの経過とエラーを表示しない（2回目の読み込み用）。
+    """
+    for file_index, (csv_file, category) in enumerate(files_to_process):
+        if report:
+            print(f"\n=== 読み込み中: {csv_file} (カテゴリ: {category}) ===")
+
+        try:
+            rows = read_csv_rows(csv_file, report=report)
+        except FileNotFoundError:
+            if report:
+                print(f"エラー: {csv_file} が見つかりません。スキップします。")
+            continue
+        except Exception as e:
+            if report:
+                print(f"エラー: {csv_file} の読み込みに失敗しました: {e}")
+            continue
+
+        completed_rows = journal.completed(csv_file)
+        if report and completed_rows:
+            print(f"前回の進捗記録があります: {len(completed_rows)}件を処理済みとしてスキップします")
+
+        for row_index, (location_name, comment) in enumerate(rows):
+            hash_value = import_journal.row_hash(csv_file, location_name, comment)
+            if hash_value in completed_rows:
+                continue
+            yield (file_index, row_index), csv_file, category, location_name, comment, hash_value
+
+def plan_title_lookups(files_to_process, journal):
+    """選択したすべてのCSVを先に読み、正規化したタイトルごとに最後に現れる行の位置を求める
+
+    タイトルはNFKC正規化（全角半角の統一）・小文字化・空白除去で比較する。
+    進捗記録で処理済みの行は除く。戻り値は ({正規化したタイトル: 最後の行の位置}, 行数)。
+    メモや行ハッシュは持たず、タイトル1種類につき位置を1つだけ保持する。
+    """
+    last_rows = {}
+    row_count = 0
+    for position, _, _, location_name, _, _ in iter_pending_rows(files_to_process, journal):
+        last_rows[normalize_name(location_name)] = position
+        row_count += 1
+    return last_rows, row_count
+
+def iter_title_lookups(files_to_process, journal, last_rows):
+    """CSVをもう一度先頭から読み、タイトルの最後の行まで読んだ時点でそのTitleLookupを返す
+
+    同じタイトルの行を1件の検索にまとめるには全CSVを見る必要があるが、内容をすべて
+    メモリに載せると行数に比例してメモリを使う。そのため1回目の読み込み
+    （plan_title_lookups）では位置だけを記録し、メモなどの内容は最初の行から
+    最後の行までの間だけ保持する。複数のCSVにまたがるタイトルだけがその間メモリに残る。
+    代わりにCSVを2回読み、検索の順序はタイトルが最後に現れた順になる。
+    """
+    pending = {}
+    for position, csv_file, category, location_name, comment, hash_value in iter_pending_rows(
+            files_to_process, journal, report=False):
+        key = normalize_name(location_name)
+        lookup = pending.get(key)
+        if lookup is None:
+            lookup = pending[key] = TitleLookup(location_name)
+        lookup.add(csv_file, category, location_name, comment, hash_value)
+        if last_rows.get(key) == position:
+            yield pending.pop(key)
+    # 読み込みの間にCSVが変更され、最後の行が見つからなかったもの
+    yield from pending.values()
+
+def save_place(place_info, location_name, comment, category, aliases=None):
+    """場所情報をMongoDBに登録し、出力用CSVファイルに追記する
+
+    aliasesを指定した場合は、同じ書き込みでaliasesにも追加する。
+    """
+    verbose(f"Retrieved location info: {place_info}")
+    
+    # 営業時間情報を別途取得するかどうか（必要に応じてTrue/Falseを切り替え）
+    get_hours = False  # 営業時間情報が必要な場合はTrueに変更
+    if get_hours:
+        opening_hours = get_opening_hours(place_info["id"], get_api_key())
+        if opening_hours:
+            place_info.update(opening_hours_fields(opening_hours))
+            # 取得日時を記録し、未取得のフィールドは次回のrefresh_places.pyで取得させる
+            place_info.update(freshness_update(None, ["businessStatus", "currentOpeningHours"], utcnow()))
+            verbose(f"Retrieved opening hours for {location_name}")
     
+    # MongoDBにデータを挿入（既存IDがあれば更新、なければ挿入）
+    with metrics.stage("mongo_write"):
+        update = {"$set": place_info}
+        if aliases:
+            update["$addToSet"] = {"aliases": {"$each": aliases}}
+        get_collection().update_one(
+            {"id": place_info["id"]},
+            update,
+            upsert=True
+        )
+    metrics.incr("registered")
+    # CSVファイルにデータを書き込む
+    output_csv.writerow([location_name, comment, place_info['url'], category])
+
+def resolve_review_queue(review_file):
+    """レビュー待ちファイルの候補を対話的に選択して登録し、未処理の分だけをファイルに残す"""
     try:
-        df = pd.read_csv(csv_file, encoding='utf-8', quotechar='"', escapechar='\\', on_bad_lines='skip')
-        print(f"CSVファイル読み込み完了: {len(df)}件のデータ")
+        with open(review_file, encoding='utf-8') as file:
+            entries = [json.loads(line) for line in file if line.strip()]
     except FileNotFoundError:
-        print(f"エラー: {csv_file} が見つかりません。スキップします。")
-        continue
-    except Exception as e:
-        print(f"エラー: {csv_file} の読み込みに失敗しました: {e}")
-        continue
-
-    # 各場所の名前について詳細情報を取得
-    for index, row in df.iterrows():
-        # location_name = unquote(row['タイトル'])
-        location_name = row['タイトル']
-        comment = row['メモ']
-        # 使用例
-        exists = check_location_exists(location_name)
-        if exists:
-            print(f"{location_name}は既にデータベースに存在します")
-        else:
-            place_info = get_place_id(location_name, category, api_key)
-            if place_info:
-                print(f"Retrieved location info: {place_info}")
-                
-                # 営業時間情報を別途取得するかどうか（必要に応じてTrue/Falseを切り替え）
-                get_hours = False  # 営業時間情報が必要な場合はTrueに変更
-                if get_hours:
-                    opening_hours = get_opening_hours(place_info["id"], api_key)
-                    if opening_hours:
-                        place_info["openingHours"] = opening_hours
-                        print(f"Retrieved opening hours for {location_name}")
-                
-                # MongoDBにデータを挿入（既存IDがあれば更新、なければ挿入）
-                collection.update_one(
-                    {"id": place_info["id"]},
-                    {"$set": place_info},
-                    upsert=True
-                )
-                # CSVファイルにデータを書き込む
-                with open(output_file, mode='a', newline='', encoding='utf-8') as file:
-                    writer = csv.writer(file)
-                    writer.writerow([location_name, comment, place_info['url'], category])
-            else:
-                print(f"Failed to retrieve place ID for {location_name}")
-
-print("\n=== 全CSVファイルの処理が完了しました ===")
+        print(f"レビュー待ちファイル {review_file} がありません")
+        return
+
+    print(f"レビュー待ち: {len(entries)}件")
+    remaining = []
+    for i, entry in enumerate(entries):
+        location_name = entry["alias"]
+        candidates = entry["candidates"]
+        selected_place = choose_place_interactively(location_name, candidates)
+        if selected_place is None:
+            answer = input("この場所をレビュー待ちに残しますか？ (y/N/q): ").strip().lower()
+            if answer == 'q':
+                remaining.extend(entries[i:])
+                break
+            if answer == 'y':
+                remaining.append(entry)
+            continue
+
+        place_info = build_place_info(selected_place, location_name, entry["category"])
+        if place_info:
+            save_place(place_info, location_name, entry.get("comment"), entry["category"])
+
+    with open(review_file, mode='w', encoding='utf-8') as file:
+        for entry in remaining:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"レビュー完了: 残り{len(remaining)}件")
+
+def main():
+    """メイン処理"""
+    load_dotenv()
+
+    # コマンドライン引数を解析
+    args = parse_arguments()
+    instrumentation.set_verbosity(args.verbose)
+    metrics.script = "main"
+
+    # 一括解決モードの地理的バイアス
+    location_bias = None
+    if args.bias:
+        latitude, longitude, radius = args.bias
+        location_bias = {"latitude": latitude, "longitude": longitude, "radius": radius}
+
+    # 利用可能なカテゴリ一覧を表示する場合
+    if args.list:
+        print("利用可能なカテゴリ:")
+        print(f"  {CAT_INSIDE_OK}: 犬店内（インナーテラス含む）OK飲食店")
+        print(f"  {CAT_TERRACE_OK}: 犬外席OK、散歩途中テイクアウトOK飲食店")
+        print(f"  {CAT_FAV_DOG_NG}: おれたちのモグモグリスト")
+        return
+
+    # レビュー待ちの候補を解決する場合
+    if args.resolve_review:
+        resolve_review_queue(args.review_file)
+        output_csv.close()
+        return
+
+    # 処理するCSVファイルを決定
+    files_to_process = get_csv_files_by_categories(args.categories)
+
+    if not files_to_process:
+        print("処理するカテゴリが指定されていません。すべてのカテゴリを処理します。")
+        files_to_process = csv_files
+
+    print(f"処理対象カテゴリ数: {len(files_to_process)}件")
+
+    ensure_indexes()
+
+    # 処理済みの行を記録する進捗記録（中断後の再実行で処理済みの行を飛ばす）
+    journal = import_journal.ImportJournal(args.journal)
+    if args.reset_journal:
+        journal.reset()
 
+    try:
+        # すべてのCSVを先に読み、同じタイトルの行を1件の検索にまとめる
+        last_rows, row_count = plan_title_lookups(files_to_process, journal)
+        metrics.incr("duplicate_rows", row_count - len(last_rows))
+        print(f"\n📋 検索する場所: {len(last_rows)}件（CSVの行数: {row_count}件、重複をまとめた行: {row_count - len(last_rows)}件）")
+
+        # 一定件数ごとに存在チェックをまとめて行う
+        lookups = iter_title_lookups(files_to_process, journal, last_rows)
+        for chunk in iter_chunks(lookups, CSV_CHUNK_SIZE):
+            existing_names = fetch_existing_location_names(title for lookup in chunk for title in lookup.titles)
+
+            # 各場所の名前について詳細情報を取得
+            for lookup in chunk:
+                location_name = lookup.title
+                if any(title in existing_names for title in lookup.titles):
+                    metrics.incr("already_exists")
+                    verbose(f"{location_name}は既にデータベースに存在します")
+                else:
+                    try:
+                        place_info = get_place_id(location_name, lookup.category, get_api_key(), batch=args.batch,
+                                                  threshold=args.threshold, location_bias=location_bias,
+                                                  review_file=args.review_file, comment=lookup.comment)
+                    except PlaceLookupError:
+                        # 進捗記録に残さず、再実行時にもう一度検索する
+                        metrics.incr("lookup_error")
+                        print(f"⚠ 検索に失敗したため、次回の実行で再試行します: {location_name}")
+                        continue
+                    except PlaceLookupSkipped:
+                        # 選択していない場所は処理済みにせず、再実行時にもう一度候補を表示する
+                        metrics.incr("skipped_by_user")
+                        continue
+                    if place_info:
+                        save_place(place_info, location_name, lookup.comment, lookup.category, lookup.aliases)
+                        existing_names.add((place_info.get("location_name") or {}).get("text"))
+                    else:
+                        metrics.incr("not_registered")
+                        verbose(f"Failed to retrieve place ID for {location_name}")
+                # 登録・既存・該当なし・レビュー待ちのいずれかに決まった行だけを処理済みにする
+                # （API呼び出しの失敗と、利用者がスキップ・キャンセルした行は残す）
+                for csv_file, hash_value in lookup.rows:
+                    journal.mark_done(csv_file, hash_value)
+    finally:
+        journal.close()
+        output_csv.close()
+        if args.metrics_file:
+            metrics.write(args.metrics_file, args.metrics_format)
+
+    # 登録があった場合は地図表示用のスナップショットを書き直す
+    if metrics.counters["registered"] and not args.no_snapshot:
+        from snapshot_export import export_snapshots
+        export_snapshots(get_collection())
+
+    print("\n=== 全CSVファイルの処理が完了しました ===")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from geo_point import backfill_geo_points, ensure_geo_index
+
+
+def migrate_geo_points(batch_size=1000):
+    """既存レコードにgeo_pointを追加し、2dsphereインデックスを作成する"""
+    client = MongoClient(os.environ.get("MONGODB_ADDRESS"))
+    db = client['places']
+    collection = db['place_info']
+
+    try:
+        missing = collection.count_documents({"geo_point": {"$exists": False}})
+        print(f"📊 geo_pointを持たないレコード: {missing}件")
+
+        updated = backfill_geo_points(collection, batch_size)
+        print(f"✓ geo_pointを追加しました: {updated}件")
+
+        remaining = collection.count_documents({"geo_point": {"$exists": False}})
+        if remaining:
+            print(f"⚠️  座標がないためgeo_pointを作成できなかったレコード: {remaining}件")
+
+        ensure_geo_index(collection)
+        print("✓ geo_pointの2dsphereインデックスを作成しました")
+    finally:
+        client.close()
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='既存レコードにGeoJSONのgeo_pointを追加し、2dsphereインデックスを作成する')
+    parser.add_argument('--batch-size', '-b', type=int, default=1000,
+                       help='1回のbulk_writeで更新する件数（デフォルト: 1000）')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+    migrate_geo_points(args.batch_size)
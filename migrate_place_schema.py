@@ -0,0 +1,91 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from place_document import SCHEMA_VERSION, normalize_document
+from geo_point import ensure_geo_index
+from opening_intervals import ensure_open_intervals_index
+
+MIGRATION_ID = f"place_schema_v{SCHEMA_VERSION}"
+
+
+def migrate_place_schema(batch_size=1000, restart=False):
+    """全レコードを_id順に走査して正規の形に揃える
+
+    バッチごとに最後に処理した_idをmigrationsコレクションに記録するため、
+    中断しても次回は続きから再開できる。
+    """
+    client = MongoClient(os.environ.get("MONGODB_ADDRESS"))
+    db = client['places']
+    collection = db['place_info']
+    progress = db['migrations']
+
+    try:
+        if restart:
+            progress.delete_one({"_id": MIGRATION_ID})
+        state = progress.find_one({"_id": MIGRATION_ID}) or {}
+        if state.get("completed"):
+            print(f"✓ {MIGRATION_ID} は完了済みです（やり直す場合は --restart）")
+            return
+
+        last_id = state.get("last_id")
+        scanned = state.get("scanned", 0)
+        updated = state.get("updated", 0)
+        if last_id is not None:
+            print(f"🔄 前回の続きから再開します（処理済み: {scanned}件）")
+
+        total = collection.estimated_document_count()
+        print(f"📊 レコード数: 約{total}件")
+
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            batch = list(collection.find(query).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+
+            operations = []
+            for record in batch:
+                update = normalize_document(record)
+                if update:
+                    operations.append(UpdateOne({"_id": record["_id"]}, update))
+            if operations:
+                updated += collection.bulk_write(operations, ordered=False).modified_count
+
+            last_id = batch[-1]["_id"]
+            scanned += len(batch)
+            progress.update_one(
+                {"_id": MIGRATION_ID},
+                {"$set": {"last_id": last_id, "scanned": scanned, "updated": updated}},
+                upsert=True
+            )
+            print(f"   • {scanned}/{total}件を確認（更新: {updated}件）")
+
+        progress.update_one({"_id": MIGRATION_ID}, {"$set": {"completed": True}}, upsert=True)
+
+        ensure_open_intervals_index(collection)
+        ensure_geo_index(collection)
+
+        print(f"\n📊 処理結果:")
+        print(f"   • 確認したレコード: {scanned}件")
+        print(f"   • 正規化したレコード: {updated}件")
+    finally:
+        client.close()
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description='currentOpeningHoursをopeningHoursに統一し、openIntervals・geo_pointを補う')
+    parser.add_argument('--batch-size', '-b', type=int, default=1000,
+                       help='1回に読み込んで更新する件数（デフォルト: 1000）')
+    parser.add_argument('--restart', action='store_true',
+                       help='記録した進捗を破棄して最初からやり直す')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+    migrate_place_schema(args.batch_size, args.restart)
@@ -0,0 +1,56 @@
+import argparse
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from geo_point import find_nearby
+
+DEFAULT_PROJECTION = {"id": 1, "location_name": 1, "primary_type": 1, "category": 1, "url": 1}
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='指定地点の近くにある場所を近い順に表示する')
+    parser.add_argument('latitude', type=float, help='緯度')
+    parser.add_argument('longitude', type=float, help='経度')
+    parser.add_argument('--radius', '-r', type=float, default=2000,
+                       help='検索半径（メートル、デフォルト: 2000）')
+    parser.add_argument('--categories', '-c', nargs='+', type=int, choices=[1, 2, 3],
+                       help='絞り込むカテゴリ (1=店内OK, 2=テラスOK, 3=犬NG)')
+    parser.add_argument('--primary-types', '-t', nargs='+',
+                       help='絞り込む種類（例: カフェ レストラン）')
+    parser.add_argument('--open-at',
+                       help='この日時に営業している場所だけを表示する（例: 2024-05-01T12:30）')
+    parser.add_argument('--open-now', action='store_true',
+                       help='現在営業している場所だけを表示する')
+    parser.add_argument('--limit', '-l', type=int, default=20,
+                       help='表示する最大件数（デフォルト: 20）')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+
+    open_at = None
+    if args.open_now:
+        open_at = datetime.now()
+    elif args.open_at:
+        open_at = datetime.fromisoformat(args.open_at)
+
+    client = MongoClient(os.environ.get("MONGODB_ADDRESS"))
+    try:
+        places = find_nearby(client['places']['place_info'], args.latitude, args.longitude,
+                             max_distance=args.radius, categories=args.categories,
+                             primary_types=args.primary_types, open_at=open_at,
+                             limit=args.limit, projection=DEFAULT_PROJECTION)
+    finally:
+        client.close()
+
+    print(f"📍 ({args.latitude}, {args.longitude}) から{args.radius:.0f}m以内: {len(places)}件")
+    for place in places:
+        name = (place.get('location_name') or {}).get('text', 'N/A')
+        primary_type = (place.get('primary_type') or {}).get('text', 'N/A')
+        print(f"   • {place['distance']:.0f}m  {name} ({primary_type}) カテゴリ{place.get('category')}")
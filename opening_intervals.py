@@ -0,0 +1,71 @@
+from bisect import bisect_right
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def _minute_of_week(point):
+    """Places APIの {day, hour, minute} を日曜0:00起点の週内分数に変換する"""
+    return point.get('day', 0) * MINUTES_PER_DAY + point.get('hour', 0) * 60 + point.get('minute', 0)
+
+
+def minute_of_week(dt):
+    """datetimeを日曜0:00起点の週内分数に変換する"""
+    day = (dt.weekday() + 1) % 7  # Python: 月曜=0, Places API: 日曜=0
+    return day * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def build_open_intervals(opening_hours):
+    """営業時間のperiodsを週内分数の区間 [{start, end}] にソート・結合して返す
+
+    日をまたぐ営業は close.day を使って連続した区間として扱い、
+    土曜から日曜にまたがる場合のみ週の境界で2つに分割する。
+    """
+    if not opening_hours:
+        return []
+
+    ranges = []
+    for period in opening_hours.get('periods') or []:
+        open_point = period.get('open')
+        if not open_point:
+            continue
+        close_point = period.get('close')
+        if not close_point:
+            # closeがない場合は24時間営業
+            return [{"start": 0, "end": MINUTES_PER_WEEK}]
+
+        start = _minute_of_week(open_point)
+        end = _minute_of_week(close_point)
+        if end <= start:
+            # 週の境界をまたぐ営業は分割する
+            ranges.append((start, MINUTES_PER_WEEK))
+            if end > 0:
+                ranges.append((0, end))
+        else:
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [{"start": start, "end": end} for start, end in merged]
+
+
+def is_open_at(intervals, minute):
+    """ソート済みの区間を二分探索し、指定した週内分数に営業しているかを返す"""
+    index = bisect_right([interval["start"] for interval in intervals], minute) - 1
+    return index >= 0 and minute < intervals[index]["end"]
+
+
+def open_at_query(dt):
+    """指定日時に営業している場所を絞り込むMongoDBクエリを返す"""
+    minute = minute_of_week(dt)
+    return {"openIntervals": {"$elemMatch": {"start": {"$lte": minute}, "end": {"$gt": minute}}}}
+
+
+def ensure_open_intervals_index(collection):
+    """openIntervalsの範囲検索用インデックスを作成する"""
+    collection.create_index([("openIntervals.start", 1), ("openIntervals.end", 1)])
@@ -0,0 +1,142 @@
+import hashlib
+import json
+
+from freshness import freshness_update, utcnow
+from geo_point import to_geo_point
+from opening_intervals import build_open_intervals
+
+# 正規の形になっているレコードに付けるスキーマのバージョン
+SCHEMA_VERSION = 1
+
+HOURS_AVAILABLE_STATUS = "available"
+HOURS_UNKNOWN_STATUS = "営業時間不明店舗"
+
+# 営業時間・営業状態の取得待ちを示すフラグ（hours_daemon.pyが処理する）
+PENDING_FIELD = "refreshPending"
+
+# 取得したAPIフィールドごとの内容のハッシュ（変化がなければ書き込みを省く）
+CONTENT_HASH_FIELD = "contentHash"
+
+
+# APIフィールドを別の名前で保存しているもの
+STORED_FIELDS = {"currentOpeningHours": "openingHours"}
+
+
+def stable_opening_hours(opening_hours):
+    """営業時間のうち取得するたびに変わらない部分（日付を除いたperiodsとweekdayDescriptions）を返す
+
+    openNowや次の開店・閉店日時、periodsの具体的な日付は取得した日時で変わるため比較に使わない。
+    """
+    if not opening_hours:
+        return None
+    periods = [
+        {key: {k: v for k, v in point.items() if k != "date"}
+         for key, point in period.items() if key in ("open", "close") and isinstance(point, dict)}
+        for period in opening_hours.get("periods") or []
+    ]
+    return {"periods": periods, "weekdayDescriptions": opening_hours.get("weekdayDescriptions") or []}
+
+
+def content_hash(field, value):
+    """APIから取得したfieldの値の、内容だけで決まるハッシュを返す"""
+    if field == "currentOpeningHours":
+        value = stable_opening_hours(value)
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def content_changed(record, field, value):
+    """取得したfieldの値が前回保存した内容と異なるか
+
+    ハッシュを持たない古いレコードは、保存している値（businessStatus・openingHours）と比べる。
+    """
+    stored = (record.get(CONTENT_HASH_FIELD) or {}).get(field)
+    stored_name = STORED_FIELDS.get(field, field)
+    if stored is None and stored_name in record:
+        stored = content_hash(field, record[stored_name])
+    return stored != content_hash(field, value)
+
+
+def opening_hours_fields(opening_hours):
+    """営業時間と、そこから計算するopeningHoursStatus・openIntervalsを返す。取得待ちフラグも下ろす"""
+    if opening_hours:
+        return {
+            "openingHours": opening_hours,
+            "openingHoursStatus": HOURS_AVAILABLE_STATUS,
+            "openIntervals": build_open_intervals(opening_hours),
+            PENDING_FIELD: False,
+        }
+    return {
+        "openingHours": None,
+        "openingHoursStatus": HOURS_UNKNOWN_STATUS,
+        "openIntervals": [],
+        PENDING_FIELD: False,
+    }
+
+
+def build_place_document(place, category, alias=None, fetched_fields=("businessStatus",), now=None):
+    """Places APIの応答から登録用のレコードを作る
+
+    営業時間はAPIのcurrentOpeningHoursをopeningHoursとして保存し、
+    openIntervalsとgeo_pointも合わせて計算する。fetched_fieldsに含めたフィールドの取得日時を記録する。
+    営業時間を取得していない場合は取得待ちフラグを立てる。
+    """
+    business_status = place.get('businessStatus')
+    document = {
+        "id": place.get('id'),
+        "location_name": place.get('displayName'),
+        "primary_type": place.get('primaryTypeDisplayName'),
+        "url": place.get('googleMapsUri'),
+        "location": place.get('location'),
+        "geo_point": to_geo_point(place.get('location')),
+        "category": category,
+        "businessStatus": business_status,
+        "schemaVersion": SCHEMA_VERSION,
+        CONTENT_HASH_FIELD: {field: content_hash(field, place.get(field)) for field in fetched_fields},
+    }
+    if alias:
+        document["alias"] = alias
+    if "currentOpeningHours" in fetched_fields:
+        document.update(opening_hours_fields(place.get('currentOpeningHours')))
+    elif business_status != "CLOSED_PERMANENTLY":
+        document[PENDING_FIELD] = True
+    document.update(freshness_update(None, fetched_fields, now or utcnow(),
+                                     closed=business_status == "CLOSED_PERMANENTLY"))
+    return document
+
+
+def normalize_document(record):
+    """既存レコードを正規の形にする更新内容（$set/$unset）を返す。変更がなければNone"""
+    set_fields = {}
+    unset_fields = {}
+
+    opening_hours = record.get('openingHours')
+    if "currentOpeningHours" in record:
+        unset_fields["currentOpeningHours"] = ""
+        # register_place_by_id.pyが以前書いていたcurrentOpeningHoursをopeningHoursに移す
+        if not opening_hours and record['currentOpeningHours']:
+            opening_hours = record['currentOpeningHours']
+            set_fields.update(opening_hours_fields(opening_hours))
+
+    if opening_hours and "openingHours" not in set_fields:
+        if "openIntervals" not in record:
+            set_fields["openIntervals"] = build_open_intervals(opening_hours)
+        if "openingHoursStatus" not in record:
+            set_fields["openingHoursStatus"] = HOURS_AVAILABLE_STATUS
+
+    if "geo_point" not in record:
+        geo_point = to_geo_point(record.get('location'))
+        if geo_point:
+            set_fields["geo_point"] = geo_point
+
+    if record.get('schemaVersion') != SCHEMA_VERSION:
+        set_fields["schemaVersion"] = SCHEMA_VERSION
+
+    if not set_fields and not unset_fields:
+        return None
+    update = {}
+    if set_fields:
+        update["$set"] = set_fields
+    if unset_fields:
+        update["$unset"] = unset_fields
+    return update
@@ -0,0 +1,14 @@
+import math
+import unicodedata
+
+
+def normalize_name(name):
+    """比較用に名前を正規化する（全角半角の統一・小文字化・空白除去）"""
+    return "".join(unicodedata.normalize("NFKC", name or "").lower().split())
+
+
+def distance_meters(lat1, lng1, lat2, lng2):
+    """2点間の距離（メートル）を返す"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# フィールドごとの有効期限（秒）。複数フィールドを取得した場合は最短のものを使う
+FIELD_TTLS = {
+    "id": 30 * DAY,
+    "displayName": 30 * DAY,
+    "location": 30 * DAY,
+    "formattedAddress": 30 * DAY,
+    "googleMapsUri": 30 * DAY,
+    "primaryTypeDisplayName": 7 * DAY,
+    "businessStatus": 1 * DAY,
+    "currentOpeningHours": 6 * HOUR,
+}
+DEFAULT_TTL = 1 * DAY
+
+DEFAULT_PATH = ".places_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class PlacesCache:
+    """Places APIのレスポンスをSQLiteに保存するTTL・LRU付きキャッシュ
+
+    同じファイルを複数のプロセス（collection_scanの分割処理など）で共有するため、
+    件数はプロセス内で数えず、削除を判断するときに書き込みトランザクションの中で数える。
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, body TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @staticmethod
+    def ttl_for(field_mask):
+        """フィールドマスクに含まれるフィールドのうち最短の有効期限を返す"""
+        fields = [f.strip().removeprefix("places.").split(".")[0] for f in field_mask.split(",")]
+        return min(FIELD_TTLS.get(f, DEFAULT_TTL) for f in fields if f)
+
+    @staticmethod
+    def make_key(endpoint, field_mask, language, query):
+        raw = json.dumps([endpoint, field_mask, language, query], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, endpoint, field_mask, language, query):
+        """キャッシュ済みのレスポンスを返す。存在しないか期限切れの場合はNone"""
+        key = self.make_key(endpoint, field_mask, language, query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(body)
+
+    def put(self, endpoint, field_mask, language, query, data):
+        """レスポンスを保存し、上限を超えた分は最終アクセスが古いものから削除する"""
+        key = self.make_key(endpoint, field_mask, language, query)
+        now = time.time()
+        body = json.dumps(data, ensure_ascii=False)
+        expires_at = now + self.ttl_for(field_mask)
+        with self._lock:
+            # 他のプロセスの書き込みと件数の確認・削除が入れ替わらないよう、書き込みロックを先に取る
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self._conn.execute(
+                    "UPDATE responses SET body = ?, expires_at = ?, accessed_at = ? WHERE key = ?",
+                    (body, expires_at, now, key),
+                ).rowcount
+                if not updated:
+                    self._conn.execute(
+                        "INSERT INTO responses (key, body, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                        (key, body, expires_at, now),
+                    )
+                    # 件数が増えるのは追加したときだけなので、そのときだけ数える
+                    overflow = self._entries() - self.max_entries
+                    if overflow > 0:
+                        self._conn.execute(
+                            "DELETE FROM responses WHERE key IN"
+                            " (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                            (overflow,),
+                        )
+                        self.evictions += overflow
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _entries(self):
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        """ヒット・ミス数などの統計情報を返す"""
+        with self._lock:
+            entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    """環境変数の設定に従って共有キャッシュを返す。PLACES_CACHE_DISABLEDが設定されていればNone"""
+    global _default_cache
+    if os.environ.get("PLACES_CACHE_DISABLED"):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PlacesCache(
+                os.environ.get("PLACES_CACHE_PATH", DEFAULT_PATH),
+                int(os.environ.get("PLACES_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+    return _default_cache
+
+
+def cache_counts():
+    """共有キャッシュのヒット数とミス数を返す（プロセスごとの集計を合算するため）。キャッシュを使わない場合は0"""
+    cache = default_cache()
+    if cache is None:
+        return {"cache_hits": 0, "cache_misses": 0}
+    stats = cache.stats()
+    return {"cache_hits": stats["hits"], "cache_misses": stats["misses"]}
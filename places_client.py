@@ -0,0 +1,141 @@
+import json
+
+from places_cache import default_cache
+from places_fetch import PlacesFetcher, default_rate, places_api_base_url
+from instrumentation import metrics
+
+try:
+    # あればorjsonで応答をデコードする（標準のjsonより速く、中間の文字列を作らない）
+    import orjson
+except ImportError:
+    orjson = None
+
+# 登録に使うフィールド
+PLACE_FIELDS = ["displayName", "primaryTypeDisplayName", "googleMapsUri", "id", "location",
+                "formattedAddress", "businessStatus"]
+
+
+class PlacesApiError(Exception):
+    """Places APIが200以外を返した"""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Status: {status_code} {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class Place(dict):
+    """Places APIの場所1件
+
+    応答のdictそのもので、キャッシュやMongoDBにそのまま渡せる。
+    よく使う値は属性として読める。
+    """
+
+    __slots__ = ()
+
+    @property
+    def id(self):
+        return self.get('id')
+
+    @property
+    def display_name(self):
+        return (self.get('displayName') or {}).get('text')
+
+    @property
+    def primary_type(self):
+        return (self.get('primaryTypeDisplayName') or {}).get('text')
+
+    @property
+    def business_status(self):
+        return self.get('businessStatus')
+
+    @property
+    def opening_hours(self):
+        return self.get('currentOpeningHours')
+
+    @property
+    def location(self):
+        return self.get('location')
+
+    @property
+    def formatted_address(self):
+        return self.get('formattedAddress')
+
+    @property
+    def is_permanently_closed(self):
+        return self.get('businessStatus') == "CLOSED_PERMANENTLY"
+
+
+def _field_mask(fields, prefix=""):
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    return ",".join(prefix + field for field in fields)
+
+
+def _decode(response):
+    with metrics.stage("json_decode"):
+        if orjson is not None:
+            return orjson.loads(response.content)
+        return response.json()
+
+
+class PlacesClient:
+    """Places API (New) のクライアント
+
+    リクエストはPlacesFetcher（コネクションプール・レート制限・リトライ・タイムアウト）を通し、
+    応答はplaces_cacheに保存する。エラー応答はPlacesApiErrorとして送出する。
+    """
+
+    def __init__(self, api_key, fetcher=None, language="ja", cache=None):
+        self.api_key = api_key
+        self.fetcher = fetcher or PlacesFetcher(concurrency=1, rate=default_rate())
+        self.language = language
+        self.cache = cache if cache is not None else default_cache()
+
+    def _headers(self, field_mask):
+        return {
+            "Content-Type": "application/json",
+            "X-Goog-FieldMask": field_mask,
+            "X-Goog-Api-Key": self.api_key,
+        }
+
+    def get_place(self, place_id, fields):
+        """Place IDの指定したフィールドを取得する"""
+        field_mask = _field_mask(fields)
+        result = self.cache.get("places", field_mask, self.language, place_id) if self.cache else None
+        if result is None:
+            url = f"{places_api_base_url()}/places/{place_id}?languageCode={self.language}"
+            response = self.fetcher.get(url, headers=self._headers(field_mask))
+            if response.status_code != 200:
+                raise PlacesApiError(response.status_code, response.text)
+            result = _decode(response)
+            if self.cache:
+                self.cache.put("places", field_mask, self.language, place_id, result)
+        return Place(result)
+
+    def search_text(self, query, fields=PLACE_FIELDS, location_bias=None, max_results=20):
+        """テキスト検索で候補を取得する。location_biasは {latitude, longitude, radius}"""
+        field_mask = _field_mask(fields, "places.")
+        cache_key = json.dumps([query, location_bias], ensure_ascii=False) if location_bias else query
+        result = self.cache.get("places:searchText", field_mask, self.language, cache_key) if self.cache else None
+        if result is None:
+            payload = {
+                "textQuery": query,
+                "languageCode": self.language,
+                "maxResultCount": max_results,
+            }
+            if location_bias:
+                payload["locationBias"] = {
+                    "circle": {
+                        "center": {"latitude": location_bias["latitude"], "longitude": location_bias["longitude"]},
+                        "radius": location_bias["radius"]
+                    }
+                }
+            response = self.fetcher.post(f"{places_api_base_url()}/places:searchText",
+                                         headers=self._headers(field_mask), json=payload)
+            if response.status_code != 200:
+                raise PlacesApiError(response.status_code, response.text)
+            result = _decode(response)
+            if self.cache:
+                self.cache.put("places:searchText", field_mask, self.language, cache_key, result)
+        return [Place(place) for place in result.get("places", [])]
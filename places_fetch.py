@@ -0,0 +1,178 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import metrics
+
+try:
+    # HTTP/2はhttpxとh2がインストールされている場合だけ使う
+    import h2  # noqa: F401
+    import httpx
+except ImportError:
+    httpx = None
+
+# Places APIのベースURL（ローカルの代替サーバーに向ける場合は環境変数PLACES_API_BASE_URLで上書きする）
+DEFAULT_BASE_URL = "https://places.googleapis.com/v1"
+
+# 呼び出し側で指定しない場合の1秒あたりの最大リクエスト数（環境変数PLACES_API_RATEで上書きする）
+DEFAULT_RATE = 10.0
+
+# リトライ対象のHTTPステータス
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# (接続, 読み込み) のタイムアウト秒数
+DEFAULT_TIMEOUT = (3.05, 10.0)
+
+# Google APIはAccept-EncodingとUser-Agentの両方に"gzip"を含む場合にgzip圧縮して返す
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip",
+    "User-Agent": "place-map-scripts (gzip)",
+}
+
+
+def places_api_base_url():
+    """環境変数の設定に従ってPlaces APIのベースURLを返す（load_dotenvの後に読むため呼び出し時に参照する）"""
+    return os.environ.get("PLACES_API_BASE_URL", DEFAULT_BASE_URL)
+
+
+def default_rate():
+    """環境変数の設定に従って1秒あたりの最大リクエスト数を返す"""
+    return float(os.environ.get("PLACES_API_RATE", DEFAULT_RATE))
+
+
+class TokenBucket:
+    """トークンバケット方式でAPI呼び出しレートを制限する"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得できるまで待機する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class PlacesFetcher:
+    """Places APIへの並列・レート制限付きリクエストを行う
+
+    httpx（h2付き）がインストールされていればHTTP/2の1つのコネクションを全スレッドで共有し、
+    なければスレッドごとにkeep-aliveのrequests.Sessionを使う。
+    """
+
+    def __init__(self, concurrency=8, rate=10.0, max_retries=5,
+                 backoff_base=0.5, backoff_max=30.0, timeout=DEFAULT_TIMEOUT, http2=None):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.http2 = httpx is not None if http2 is None else http2
+        if self.http2 and httpx is None:
+            raise ImportError("HTTP/2を使うには httpx[http2] をインストールしてください")
+        self._local = threading.local()
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _session(self):
+        """スレッドごとにkeep-aliveのSessionを使い回す"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+        return session
+
+    def _http2_client(self):
+        """全スレッドで共有するHTTP/2クライアントを返す"""
+        with self._client_lock:
+            if self._client is None:
+                connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+                self._client = httpx.Client(
+                    http2=True,
+                    headers=DEFAULT_HEADERS,
+                    timeout=httpx.Timeout(read, connect=connect),
+                    limits=httpx.Limits(max_connections=self.concurrency,
+                                        max_keepalive_connections=self.concurrency),
+                )
+            return self._client
+
+    def _send(self, method, url, **kwargs):
+        if self.http2:
+            return self._http2_client().request(method, url, **kwargs)
+        kwargs.setdefault("timeout", self.timeout)
+        return self._session().request(method, url, **kwargs)
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    def _backoff(self, attempt, response=None):
+        """ジッター付き指数バックオフの待機秒数を返す"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(self.backoff_max, float(retry_after))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, **kwargs):
+        """429/5xxおよび接続エラーをリトライしながらリクエストを送る"""
+        retry_errors = (httpx.TransportError,) if self.http2 else (requests.ConnectionError, requests.Timeout)
+        field_mask = (kwargs.get("headers") or {}).get("X-Goog-FieldMask", "")
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = None
+            try:
+                with metrics.stage("http_fetch"):
+                    response = self._send(method, url, **kwargs)
+            except retry_errors:
+                metrics.count_api_call(field_mask, "error")
+                if attempt == self.max_retries:
+                    raise
+            else:
+                metrics.count_api_call(field_mask, response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return response
+            time.sleep(self._backoff(attempt, response))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def map_unordered(self, fn, items):
+        """itemsの各要素にfnをワーカープールで適用し、完了順に(item, 結果)を返す"""
+        max_pending = self.concurrency * 2
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            for item in items:
+                pending.add(executor.submit(lambda x: (x, fn(x)), item))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
@@ -0,0 +1,211 @@
+import os
+import argparse
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from places_fetch import PlacesFetcher
+from places_client import PlacesApiError, PlacesClient
+from bulk_writer import BulkWriter
+from freshness import (FAILURE_COUNT_FIELD, backfill_next_refresh, due_query, due_records, ensure_refresh_indexes,
+                       failure_update, freshness_update, stale_fields, utcnow)
+from opening_intervals import ensure_open_intervals_index
+from place_document import CONTENT_HASH_FIELD, content_changed, content_hash, opening_hours_fields
+from event_log import EventLog
+import instrumentation
+from instrumentation import metrics, verbose
+
+load_dotenv()
+
+def get_place_fields(place_id, fields, places_client):
+    """指定したフィールドを1回のリクエストでまとめて取得する"""
+    try:
+        return places_client.get_place(place_id, fields)
+    except PlacesApiError as e:
+        print(f"❌ API呼び出しエラー: {place_id} - {str(e)}")
+        return None
+    except Exception as e:
+        print(f"❌ エラーが発生しました: {place_id} - {str(e)}")
+        return None
+
+
+def build_update(record, fields, result, now):
+    """取得結果からレコードに書き込むべき変更フィールドと取得日時を組み立てる"""
+    update = {}
+    if "businessStatus" in fields and result.get('businessStatus'):
+        update["businessStatus"] = result['businessStatus']
+    # 営業時間は日付やopenNowを除いた内容が変わった場合だけ書き込む
+    if "currentOpeningHours" in fields and content_changed(record, "currentOpeningHours",
+                                                           result.get('currentOpeningHours')):
+        update.update(opening_hours_fields(result.get('currentOpeningHours')))
+
+    # 値が変わっていないフィールドは書き込まない
+    update = {key: value for key, value in update.items() if record.get(key) != value}
+    stored_hashes = record.get(CONTENT_HASH_FIELD) or {}
+    for field in fields:
+        value_hash = content_hash(field, result.get(field))
+        if stored_hashes.get(field) != value_hash:
+            update[f"{CONTENT_HASH_FIELD}.{field}"] = value_hash
+    closed = result.get('businessStatus') == "CLOSED_PERMANENTLY"
+    update.update(freshness_update(record, fields, now, closed=closed))
+    if record.get(FAILURE_COUNT_FIELD):
+        update[FAILURE_COUNT_FIELD] = 0
+    return update
+
+
+def record_changes(event_log, record, update):
+    """営業状態と営業時間の変化をイベントログに追記する。初めて取得した値は変化とみなさない"""
+    if "businessStatus" in update and record.get('businessStatus'):
+        event_log.append("businessStatus", record, previous=record['businessStatus'],
+                         current=update['businessStatus'])
+    if "openingHours" in update and record.get('openingHours'):
+        event_log.append("openingHours", record,
+                         previous=record['openingHours'].get('weekdayDescriptions'),
+                         current=(update['openingHours'] or {}).get('weekdayDescriptions'))
+
+
+def refresh_stale_places(concurrency=8, rate=10.0, batch_size=500, flush_interval=2.0,
+                         max_calls=1000, priority_categories=None, event_log_path=None):
+    """更新期限を過ぎたレコードのbusiness_statusと営業時間を1回のAPI呼び出しでまとめて更新する
+
+    営業状態と営業時間の変化は発生時にイベントログへ追記する。
+    event_log_pathを省略した場合は環境変数PLACES_EVENT_LOGかデフォルトのファイルに追記する。
+    """
+
+    # MongoDB接続
+    client = MongoClient(os.environ["MONGODB_ADDRESS"])
+    db = client.places
+    collection = db.place_info
+
+    # Google APIキー
+    api_key = os.environ["GOOGLE_MAPS_API_KEY"]
+
+    event_log = EventLog(event_log_path, "refresh_places")
+
+    try:
+        ensure_refresh_indexes(collection)
+        ensure_open_intervals_index(collection)
+        backfilled = backfill_next_refresh(collection)
+        if backfilled:
+            print(f"📅 更新スケジュールを初期化しました: {backfilled}件")
+
+        now = utcnow()
+        with metrics.stage("mongo_read"):
+            due_count = collection.count_documents(due_query(now))
+        total_count = min(due_count, max_calls)
+        print(f"📊 更新期限を過ぎたレコード数: {due_count}件")
+        print(f"   • 今回の処理件数（上限 {max_calls}件）: {total_count}件")
+        if total_count == 0:
+            print("✓ すべてのレコードが最新です")
+            return
+
+        print("=" * 60)
+
+        skipped_count = 0
+        failed_count = 0
+        closed_count = 0
+        api_calls = 0
+
+        fetcher = PlacesFetcher(concurrency=concurrency, rate=rate)
+        places_client = PlacesClient(api_key, fetcher)
+
+        def fetch(record):
+            place_id = record.get('id')
+            fields = stale_fields(record, now)
+            if not place_id or not fields:
+                return fields, None
+            return fields, get_place_fields(place_id, fields, places_client)
+
+        with BulkWriter(collection, batch_size=batch_size, flush_interval=flush_interval) as writer:
+
+            records = metrics.timed_iter("mongo_read", due_records(collection, max_calls, priority_categories, now))
+            results = fetcher.map_unordered(fetch, records)
+            for i, (record, (fields, result)) in enumerate(results, 1):
+                location_name = record.get('location_name', {}).get('text', 'N/A')
+
+                if not record.get('id'):
+                    print(f"⚠ Place IDが見つかりません: {location_name}")
+                    failed_count += 1
+                    metrics.incr("missing_place_id")
+                    continue
+                if not fields:
+                    # 期限切れのフィールドがなければ次回更新日時だけ進める
+                    writer.update_one({"_id": record["_id"]}, {"$set": freshness_update(record, [], now)})
+                    skipped_count += 1
+                    metrics.incr("not_due")
+                    continue
+
+                api_calls += 1
+                if result is None:
+                    verbose(f"⚠ 取得失敗: {location_name}")
+                    failed_count += 1
+                    metrics.incr("fetch_failed")
+                    # 失敗回数を記録し、次回更新日時をバックオフ分だけ先に送る
+                    writer.update_one({"_id": record["_id"]}, {"$set": failure_update(record, now)})
+                    continue
+
+                update = build_update(record, fields, result, now)
+                changed = [key for key in update
+                           if key not in ("nextRefreshAt", FAILURE_COUNT_FIELD)
+                           and not key.startswith(("fetchedAt.", f"{CONTENT_HASH_FIELD}."))]
+                if not changed:
+                    skipped_count += 1
+                    metrics.incr("unchanged")
+                else:
+                    metrics.incr("changed")
+                    record_changes(event_log, record, update)
+                    verbose(f"[{i}/{total_count}] 更新: {location_name} ({', '.join(changed)})")
+
+                if update.get("businessStatus") == "CLOSED_PERMANENTLY":
+                    closed_count += 1
+                    verbose(f"✓ 閉業店舗を発見: {location_name}")
+
+                writer.update_one({"_id": record["_id"]}, {"$set": update})
+
+        print("=" * 60)
+        print(f"📊 処理結果:")
+        print(f"   • 総対象レコード数: {total_count}件")
+        print(f"   • API呼び出し数: {api_calls}件")
+        print(f"   • 更新成功: {writer.modified_count}件")
+        print(f"   • 値の変更なし: {skipped_count}件")
+        print(f"   • 閉業店舗としてマーキング: {closed_count}件")
+        print(f"   • 更新失敗: {failed_count + writer.error_count}件")
+        print(f"   • イベントログに追記: {event_log.count}件（{event_log.path}）")
+        print("=" * 60)
+
+    except Exception as e:
+        print(f"❌ 処理中にエラーが発生しました: {str(e)}")
+    finally:
+        event_log.close()
+        client.close()
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='business_statusと営業時間をまとめて更新する')
+    parser.add_argument('--concurrency', '-n', type=int, default=8,
+                       help='Places APIへの同時リクエスト数（デフォルト: 8）')
+    parser.add_argument('--rate', '-r', type=float, default=10.0,
+                       help='1秒あたりの最大APIリクエスト数（デフォルト: 10）')
+    parser.add_argument('--batch-size', '-b', type=int, default=500,
+                       help='bulk_writeでまとめて書き込む件数（デフォルト: 500）')
+    parser.add_argument('--flush-interval', type=float, default=2.0,
+                       help='バッチを強制的に書き込むまでの秒数（デフォルト: 2.0）')
+    parser.add_argument('--max-calls', '-m', type=int, default=1000,
+                       help='1回の実行で行うAPI呼び出しの上限（デフォルト: 1000）')
+    parser.add_argument('--priority-categories', '-p', nargs='+', type=int,
+                       help='優先して更新するカテゴリ番号')
+    parser.add_argument('--event-log',
+                       help='営業状態と営業時間の変化を追記するファイル（デフォルト: 環境変数PLACES_EVENT_LOG、なければplace_events.jsonl）')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    instrumentation.set_verbosity(args.verbose)
+    metrics.script = "refresh_places"
+    print("🔄 business_statusと営業時間の更新を開始します...")
+    refresh_stale_places(args.concurrency, args.rate, args.batch_size, args.flush_interval,
+                         args.max_calls, args.priority_categories, args.event_log)
+    if args.metrics_file:
+        metrics.write(args.metrics_file, args.metrics_format)
+    print("✅ 処理が完了しました")
@@ -1,9 +1,14 @@
 import os
 import sys
-import requests
-import json
+import csv
+import argparse
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from places_fetch import PlacesFetcher
+from places_client import PLACE_FIELDS, PlacesApiError, PlacesClient
+from place_document import build_place_document
+from instrumentation import metrics
 
 # Category constants
 CAT_INSIDE_OK = 1
@@ -15,85 +20,174 @@ load_dotenv()
 # 以下からPlace IDを取得する
 # https://developers.google.com/maps/documentation/javascript/examples/places-placeid-finder
 
-def get_place_details(place_id, api_key):
+def get_place_details(place_id, places_client):
     """Google Places API からPlace IDの詳細情報を取得する"""
-    
-    url = f"https://places.googleapis.com/v1/places/{place_id}?languageCode=ja"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-FieldMask": "displayName,primaryTypeDisplayName,googleMapsUri,id,location,formattedAddress,businessStatus,currentOpeningHours",
-        "X-Goog-Api-Key": api_key,
-    }
-
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        print(f"エラー: {response.json()}")
+    try:
+        return places_client.get_place(place_id, PLACE_FIELDS + ["currentOpeningHours"])
+    except PlacesApiError as e:
+        print(f"エラー: {place_id} - {str(e)}")
+        return None
+
+def build_upsert(place_data, category, alias=None):
+    """登録用のUpdateOneを作成する。永久閉店の場合はNone"""
+    if place_data.get('businessStatus') == 'CLOSED_PERMANENTLY':
         return None
 
-    return response.json()
+    place_info = build_place_document(place_data, category, alias,
+                                      fetched_fields=["businessStatus", "currentOpeningHours"])
+    # 既存IDがあれば更新、なければ挿入
+    return UpdateOne(
+        {"id": place_info["id"]},
+        {"$set": place_info, "$unset": {"currentOpeningHours": ""}},
+        upsert=True
+    )
 
 def register_place_to_mongodb(place_data, category, alias=None):
     """MongoDBに場所情報を登録する"""
     
+    # 登録用データの作成
+    operation = build_upsert(place_data, category, alias)
+    if operation is None:
+        print(f"⚠️  {place_data.get('displayName', {}).get('text', 'N/A')} は永久閉店のため登録しません")
+        return False
+
     # MongoDB接続設定
     client = MongoClient(os.environ["MONGODB_ADDRESS"])
     db = client.places
     collection = db.place_info
 
-    # 登録用データの作成
-    place_info = {
-        "id": place_data.get('id'),
-        "location_name": place_data.get('displayName'),
-        "primary_type": place_data.get('primaryTypeDisplayName'),
-        "url": place_data.get('googleMapsUri'),
-        "location": place_data.get('location'),
-        "category": category,
-        "businessStatus": place_data.get('businessStatus'),
-        "currentOpeningHours": place_data.get('currentOpeningHours')
-    }
-
-    # aliasが指定されている場合は追加
-    if alias:
-        place_info["alias"] = alias
-
-    # businessStatusをチェック
-    business_status = place_data.get('businessStatus')
-    if business_status == 'CLOSED_PERMANENTLY':
-        print(f"⚠️  {place_data.get('displayName', {}).get('text', 'N/A')} は永久閉店のため登録しません")
-        return False
-
-    # MongoDBにデータを挿入（既存IDがあれば更新、なければ挿入）
-    result = collection.update_one(
-        {"id": place_info["id"]},
-        {"$set": place_info},
-        upsert=True
-    )
+    try:
+        with metrics.stage("mongo_write"):
+            result = collection.bulk_write([operation])
+    finally:
+        client.close()
 
-    if result.upserted_id:
+    if result.upserted_count:
         print(f"✓ 新しい場所を登録しました: {place_data.get('displayName', {}).get('text', 'N/A')}")
     else:
         print(f"✓ 既存の場所を更新しました: {place_data.get('displayName', {}).get('text', 'N/A')}")
 
     return True
 
-def main():
-    """メイン処理"""
-    
-    if len(sys.argv) < 3:
-        print("使用方法: python register_place_by_id.py <place_id> <category> [alias]")
-        print("category: 1=店内OK, 2=テラスOK, 3=犬NG")
-        print("例: python register_place_by_id.py ChIJN1t_tDeuEmsRUsoyG83frY4 1")
-        sys.exit(1)
+VALID_CATEGORIES = [CAT_INSIDE_OK, CAT_TERRACE_OK, CAT_FAV_DOG_NG]
+
+def read_batch_rows(file):
+    """place_id,category,alias 形式の行を読み込む。ヘッダー行・空行・#で始まる行は飛ばす"""
+    rows = []
+    for line_number, row in enumerate(csv.reader(file), 1):
+        if not row or not row[0].strip() or row[0].startswith('#') or row[0].strip() == 'place_id':
+            continue
+        place_id = row[0].strip()
+        alias = row[2].strip() if len(row) > 2 and row[2].strip() else None
+        try:
+            category = int(row[1])
+        except (IndexError, ValueError):
+            category = None
+        if category not in VALID_CATEGORIES:
+            print(f"❌ {line_number}行目: カテゴリは1, 2, 3のいずれかを指定してください: {','.join(row)}")
+            continue
+        rows.append((place_id, category, alias))
+    return rows
+
+def register_places_batch(rows, api_key, concurrency=8, rate=10.0, batch_size=500):
+    """複数のPlace IDの詳細を並列に取得し、まとめてupsertする。失敗した件数を返す"""
+    print(f"📊 登録対象: {len(rows)}件")
+    print("-" * 50)
 
-    place_id = sys.argv[1]
-    category = int(sys.argv[2])
-    alias = sys.argv[3] if len(sys.argv) > 3 else None
+    fetcher = PlacesFetcher(concurrency=concurrency, rate=rate)
+    places_client = PlacesClient(api_key, fetcher)
+
+    def fetch(row):
+        place_id, _, _ = row
+        try:
+            return get_place_details(place_id, places_client)
+        except Exception as e:
+            print(f"❌ エラーが発生しました: {place_id} - {str(e)}")
+            return None
+
+    # 取得できた行と、その行のupsert操作
+    pending = []
+    failed_count = 0
+    closed_count = 0
+    for row, place_data in fetcher.map_unordered(fetch, rows):
+        place_id, category, alias = row
+        if not place_data:
+            print(f"❌ 取得失敗: {place_id}")
+            failed_count += 1
+            continue
+        operation = build_upsert(place_data, category, alias)
+        if operation is None:
+            print(f"⚠️  永久閉店のため登録しません: {place_data.get('displayName', {}).get('text', 'N/A')} ({place_id})")
+            closed_count += 1
+            continue
+        pending.append((row, place_data, operation))
+
+    # MongoDBクライアントは1つだけ作り、まとめてbulk_writeする
+    client = MongoClient(os.environ["MONGODB_ADDRESS"])
+    collection = client.places.place_info
+    created_count = 0
+    updated_count = 0
+    try:
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            try:
+                with metrics.stage("mongo_write"):
+                    result = collection.bulk_write([operation for _, _, operation in chunk], ordered=False)
+                details = result.bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+            upserted = {item["index"] for item in details.get("upserted", [])}
+            errors = {item["index"]: item.get("errmsg") for item in details.get("writeErrors", [])}
+
+            for index, ((place_id, category, _), place_data, _) in enumerate(chunk):
+                display_name = place_data.get('displayName', {}).get('text', 'N/A')
+                if index in errors:
+                    print(f"❌ 書き込み失敗: {display_name} ({place_id}) - {errors[index]}")
+                    failed_count += 1
+                elif index in upserted:
+                    print(f"✓ 新しい場所を登録しました: {display_name} ({place_id}, カテゴリ{category})")
+                    created_count += 1
+                else:
+                    print(f"✓ 既存の場所を更新しました: {display_name} ({place_id}, カテゴリ{category})")
+                    updated_count += 1
+    finally:
+        client.close()
+
+    print("=" * 50)
+    print(f"📊 処理結果:")
+    print(f"   • 新規登録: {created_count}件")
+    print(f"   • 更新: {updated_count}件")
+    print(f"   • 永久閉店のため未登録: {closed_count}件")
+    print(f"   • 失敗: {failed_count}件")
+    return failed_count
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(
+        description='Place IDを指定して場所を登録する',
+        epilog='例: python register_place_by_id.py ChIJN1t_tDeuEmsRUsoyG83frY4 1 / '
+               'python register_place_by_id.py --file ids.csv / cat ids.csv | python register_place_by_id.py --file -'
+    )
+    parser.add_argument('place_id', nargs='?', help='登録するPlace ID')
+    parser.add_argument('category', nargs='?', type=int, choices=VALID_CATEGORIES,
+                       help='カテゴリ (1=店内OK, 2=テラスOK, 3=犬NG)')
+    parser.add_argument('alias', nargs='?', help='エイリアス')
+    parser.add_argument('--file', '-f',
+                       help='place_id,category,alias 形式の行を読み込むファイル（- で標準入力）')
+    parser.add_argument('--concurrency', '-n', type=int, default=8,
+                       help='一括登録時の同時リクエスト数（デフォルト: 8）')
+    parser.add_argument('--rate', '-r', type=float, default=10.0,
+                       help='一括登録時の1秒あたりの最大リクエスト数（デフォルト: 10）')
+    parser.add_argument('--batch-size', '-b', type=int, default=500,
+                       help='1回のbulk_writeで書き込む件数（デフォルト: 500）')
+    args = parser.parse_args()
+    if not args.file and (args.place_id is None or args.category is None):
+        parser.error("Place IDとカテゴリ、または --file を指定してください")
+    return args
 
-    # カテゴリの妥当性チェック
-    if category not in [CAT_INSIDE_OK, CAT_TERRACE_OK, CAT_FAV_DOG_NG]:
-        print("エラー: カテゴリは1, 2, 3のいずれかを指定してください")
-        print("1=店内OK, 2=テラスOK, 3=犬NG")
-        sys.exit(1)
+def main():
+    """メイン処理"""
+    args = parse_arguments()
 
     # Google APIキー
     api_key = os.environ.get("GOOGLE_MAPS_API_KEY")
@@ -101,6 +195,21 @@ def main():
         print("エラー: GOOGLE_MAPS_API_KEY環境変数が設定されていません")
         sys.exit(1)
 
+    if args.file:
+        if args.file == '-':
+            rows = read_batch_rows(sys.stdin)
+        else:
+            with open(args.file, newline='', encoding='utf-8') as file:
+                rows = read_batch_rows(file)
+        failed_count = register_places_batch(rows, api_key, args.concurrency, args.rate, args.batch_size)
+        if failed_count:
+            sys.exit(1)
+        return
+
+    place_id = args.place_id
+    category = args.category
+    alias = args.alias
+
     print(f"Place ID: {place_id}")
     print(f"カテゴリ: {category}")
     if alias:
@@ -108,7 +217,7 @@ def main():
     print("-" * 50)
 
     # Place IDから詳細情報を取得
-    place_data = get_place_details(place_id, api_key)
+    place_data = get_place_details(place_id, PlacesClient(api_key))
     if not place_data:
         print("場所の詳細情報を取得できませんでした")
         sys.exit(1)
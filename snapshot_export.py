@@ -0,0 +1,149 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from instrumentation import metrics
+
+# スナップショットの出力先（環境変数PLACES_SNAPSHOT_DIRで上書きできる）
+DEFAULT_SNAPSHOT_DIR = "snapshots"
+
+# 残しておく過去のバージョン数
+KEEP_VERSIONS = 3
+
+# 地図の表示に使うフィールドだけを読み込む（地図アプリがAPIから受け取るのと同じ名前・形のまま書き出す）
+SNAPSHOT_PROJECTION = {
+    "_id": 0, "id": 1, "location_name.text": 1, "primary_type.text": 1, "url": 1, "address": 1,
+    "location": 1, "category": 1, "businessStatus": 1, "openingHours": 1, "openIntervals": 1,
+}
+
+SNAPSHOT_FIELDS = [field.split(".")[0] for field in SNAPSHOT_PROJECTION if field != "_id"]
+
+UNKNOWN_PRIMARY_TYPE = "その他"
+
+
+def snapshot_dir():
+    """環境変数の設定に従って出力先を返す（load_dotenvの後に読むため呼び出し時に参照する）"""
+    return os.environ.get("PLACES_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+
+
+def snapshot_record(record):
+    """レコードをスナップショット用に変換する。PlaceCardなどが読むlocation_name.text・address・
+    openingHoursは、APIの応答と同じ入れ子の形のまま残す
+    """
+    return {field: record.get(field) for field in SNAPSHOT_FIELDS}
+
+
+def _dump(data):
+    """ハッシュが内容だけで決まるよう、キー順と区切り文字を固定してシリアライズする"""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _file_name(primary_type):
+    """種類名をファイル名に使える形にする"""
+    return "".join("_" if char in '/\\:*?"<>|' or ord(char) < 32 else char for char in primary_type)
+
+
+def _write_partition(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(body)
+    # 配信時にそのまま返せる圧縮済みファイル（mtimeを固定して内容が同じなら同じバイト列にする）
+    with open(path + ".gz", "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as file:
+        file.write(body)
+
+
+def _prune(output_dir, keep):
+    versions = sorted(name for name in os.listdir(output_dir)
+                      if os.path.isdir(os.path.join(output_dir, name)) and not name.startswith("."))
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+
+
+def export_snapshots(collection, output_dir=None, keep=KEEP_VERSIONS):
+    """永久閉店を除いた場所をカテゴリと種類ごとのJSONファイルに書き出す
+
+    出力先には <バージョン>/category-<n>/<種類>.json（と.json.gz）と、各ファイルの
+    件数・SHA-256（ETag用）をまとめた manifest.json を作る。書き出しが終わってから
+    latest.json を置き換えるため、配信側が書きかけのバージョンを読むことはない。
+    """
+    output_dir = output_dir or snapshot_dir()
+    os.makedirs(output_dir, exist_ok=True)
+
+    partitions = defaultdict(list)
+    cursor = collection.find({"businessStatus": {"$ne": "CLOSED_PERMANENTLY"}}, SNAPSHOT_PROJECTION)
+    for record in metrics.timed_iter("mongo_read", cursor):
+        place = snapshot_record(record)
+        primary_type = (place["primary_type"] or {}).get("text") or UNKNOWN_PRIMARY_TYPE
+        partitions[(place["category"], primary_type)].append(place)
+
+    version = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    staging_dir = os.path.join(output_dir, f".{version}.tmp")
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    entries = []
+    with metrics.stage("snapshot_write"):
+        for (category, primary_type), places in sorted(partitions.items(), key=lambda item: str(item[0])):
+            places.sort(key=lambda place: place["id"] or "")
+            body = _dump(places)
+            relative_path = f"category-{category}/{_file_name(primary_type)}.json"
+            _write_partition(os.path.join(staging_dir, relative_path), body)
+            entries.append({
+                "category": category,
+                "primary_type": primary_type,
+                "path": relative_path,
+                "count": len(places),
+                "bytes": len(body),
+                "sha256": hashlib.sha256(body).hexdigest(),
+            })
+
+        manifest = {
+            "version": version,
+            "count": sum(entry["count"] for entry in entries),
+            # 全ファイルの内容から決まるハッシュ（データに変更がなければ同じ値になる）
+            "sha256": hashlib.sha256("".join(entry["sha256"] for entry in entries).encode()).hexdigest(),
+            "partitions": entries,
+        }
+        with open(os.path.join(staging_dir, "manifest.json"), "wb") as file:
+            file.write(_dump(manifest))
+
+        version_dir = os.path.join(output_dir, version)
+        shutil.rmtree(version_dir, ignore_errors=True)
+        os.replace(staging_dir, version_dir)
+
+        latest = {"version": version, "manifest": f"{version}/manifest.json", "sha256": manifest["sha256"]}
+        latest_tmp = os.path.join(output_dir, ".latest.json.tmp")
+        with open(latest_tmp, "wb") as file:
+            file.write(_dump(latest))
+        os.replace(latest_tmp, os.path.join(output_dir, "latest.json"))
+
+    _prune(output_dir, keep)
+    print(f"📦 スナップショットを書き出しました: {version_dir}（{manifest['count']}件 / {len(entries)}ファイル）")
+    return manifest
+
+
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='地図表示用のスナップショットをカテゴリ・種類ごとに書き出す')
+    parser.add_argument('--output-dir', '-o',
+                       help=f'出力先ディレクトリ（デフォルト: 環境変数PLACES_SNAPSHOT_DIR、なければ{DEFAULT_SNAPSHOT_DIR}）')
+    parser.add_argument('--keep', type=int, default=KEEP_VERSIONS,
+                       help=f'残しておくバージョン数（デフォルト: {KEEP_VERSIONS}）')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+    client = MongoClient(os.environ["MONGODB_ADDRESS"])
+    try:
+        export_snapshots(client.places.place_info, args.output_dir, args.keep)
+    finally:
+        client.close()
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+import pytest
+
+from freshness import EPOCH, due_records, freshness_update, utcnow
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_closed_record_is_never_due():
+    """永久閉店の場所はnextRefreshAtが過去のままでもdue_recordsで選ばれない"""
+    collection = mongomock.MongoClient().places.place_info
+    now = utcnow()
+    collection.insert_many(
+        [{"id": f"closed-{i}", "businessStatus": "CLOSED_PERMANENTLY", "nextRefreshAt": EPOCH + timedelta(days=i)}
+         for i in range(5)]
+        + [{"id": "open", "businessStatus": "OPERATIONAL", "nextRefreshAt": now - timedelta(days=1)}]
+    )
+
+    assert [record["id"] for record in due_records(collection, 5, now=now)] == ["open"]
+    assert [record["id"] for record in due_records(collection, 5, priority_categories=[1], now=now)] == ["open"]
+
+
+def test_freshness_update_unschedules_closed_record():
+    """closedを省略してもrecordが永久閉店なら次回更新日時を消す"""
+    record = {"businessStatus": "CLOSED_PERMANENTLY", "fetchedAt": {}}
+    assert freshness_update(record, [])["nextRefreshAt"] is None
+    assert freshness_update({"businessStatus": "OPERATIONAL"}, [])["nextRefreshAt"] == EPOCH + timedelta(days=7)
@@ -1,188 +1,318 @@
 import os
-import requests
-import json
+import argparse
 from dotenv import load_dotenv
 from pymongo import MongoClient
-import time
+from pymongo.errors import PyMongoError
+from places_fetch import PlacesFetcher
+from places_client import PlacesApiError, PlacesClient
+from bulk_writer import BulkWriter
+from places_cache import cache_counts, default_cache
+from freshness import freshness_update, utcnow
+from place_document import CONTENT_HASH_FIELD, content_changed, content_hash
+from event_log import EventLog, default_event_log_path
+import instrumentation
+from instrumentation import metrics, verbose
+from snapshot_export import export_snapshots
+from collection_scan import SCAN_PROJECTION, combine_results, id_ranges, partition_query, run_partitions
+from work_lease import DEFAULT_LEASE_SECONDS, LeaseQueue, default_job, ensure_lease_index
 
 load_dotenv()
 
-def get_business_status(place_id, api_key):
+def get_business_status(place_id, places_client):
     """business_status情報を取得する関数"""
-    url = f"https://places.googleapis.com/v1/places/{place_id}?languageCode=ja"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-FieldMask": "businessStatus",
-        "X-Goog-Api-Key": api_key,
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            result = response.json()
-            business_status = result.get('businessStatus')
-            if business_status:
-                print(f"✓ business_statusを取得しました: {place_id} - {business_status}")
-                return business_status
-            else:
-                print(f"⚠ business_status情報がありません: {place_id}")
-                return None
+        business_status = places_client.get_place(place_id, ["businessStatus"]).business_status
+        if business_status:
+            verbose(f"✓ business_statusを取得しました: {place_id} - {business_status}")
+            return business_status
         else:
-            print(f"❌ API呼び出しエラー: {place_id} - Status: {response.status_code}")
-            print(f"Response: {response.text}")
+            verbose(f"⚠ business_status情報がありません: {place_id}")
             return None
+    except PlacesApiError as e:
+        print(f"❌ API呼び出しエラー: {place_id} - {str(e)}")
+        return None
     except Exception as e:
         print(f"❌ エラーが発生しました: {place_id} - {str(e)}")
         return None
 
-def update_closed_business_status():
-    """閉業店舗（CLOSED_PERMANENTLY）のbusiness_statusを更新する"""
+# businessStatusが未設定またはCLOSED_PERMANENTLYでないレコード
+UNCLOSED_QUERY = {
+    "$or": [
+        {"businessStatus": {"$exists": False}},
+        {"businessStatus": {"$ne": "CLOSED_PERMANENTLY"}}
+    ]
+}
+
+# 前回の値と比べるためにbusinessStatusとハッシュも読み込む
+RECORD_PROJECTION = {**SCAN_PROJECTION, "businessStatus": 1, CONTENT_HASH_FIELD: 1}
+
+def update_partition(id_range, concurrency, rate, batch_size, flush_interval, lease_job=None,
+                     lease_seconds=DEFAULT_LEASE_SECONDS, event_log_path=None):
+    """_idの範囲内で閉業していないレコードのbusiness_statusを更新し、件数を辞書で返す
+
+    値が前回と同じレコードは取得日時だけを書き込み、変化したものはイベントログに追記する。
+    """
     
-    # MongoDB接続
+    # プロセスごとに接続する
     client = MongoClient(os.environ["MONGODB_ADDRESS"])
-    db = client.places
-    collection = db.place_info
+    collection = client.places.place_info
     
     # Google APIキー
     api_key = os.environ["GOOGLE_MAPS_API_KEY"]
     
-    # 閉業店舗リストを保存するためのリスト
-    closed_businesses = []
+    # 営業状態の変化を発生時に追記する
+    event_log = EventLog(event_log_path, "update_business_status")
+    
+    # キャッシュの集計はプロセスごとなので、この範囲の分だけを返して親プロセスで合算する
+    cache_start = cache_counts()
+    lease_queue = None
     
     try:
-        # businessStatusが未設定またはCLOSED_PERMANENTLYでないレコードを検索
-        query_condition = {
-            "$or": [
-                {"businessStatus": {"$exists": False}},
-                {"businessStatus": {"$ne": "CLOSED_PERMANENTLY"}}
-            ]
-        }
-        
-        records_to_check = collection.find(query_condition)
-        
-        # 全レコード数を確認
-        all_records_count = collection.count_documents({})
-        
-        # レコード数を確認
-        total_count = collection.count_documents(query_condition)
-        
-        print(f"📊 データベース統計:")
-        print(f"   • 全レコード数: {all_records_count}件")
-        print(f"   • business_status確認対象レコード数: {total_count}件")
-        print(f"   • 既に閉業としてマーキング済みレコード数: {all_records_count - total_count}件")
-        
-        if total_count == 0:
-            print("✓ すべてのレコードのbusiness_statusが確認済みです")
-            return
-        
-        print("=" * 60)
+        query = partition_query(UNCLOSED_QUERY, id_range)
+        if lease_job:
+            # 他のホスト・プロセスと同じレコードを処理しないよう、リースを取りながら1件ずつ読み込む
+            lease_queue = LeaseQueue(collection, query, "update_business_status", lease_job, RECORD_PROJECTION, lease_seconds)
+            lease_queue.start()
+            records = lease_queue
+        else:
+            # 必要なフィールドだけを読み込む
+            records = collection.find(query, RECORD_PROJECTION)
+        records_to_check = metrics.timed_iter("mongo_read", records)
         
-        updated_count = 0
+        processed_count = 0
+        unchanged_count = 0
+        changed_count = 0
         closed_count = 0
         failed_count = 0
+        # イベントログに残す更新は書き込みキューを通さずに書き込み、結果を確かめる
+        applied_modified = 0
+        applied_lost = 0
         
-        for i, record in enumerate(records_to_check, 1):
+        # 並列・レート制限付きでbusiness_statusを取得する
+        fetcher = PlacesFetcher(concurrency=concurrency, rate=rate)
+        places_client = PlacesClient(api_key, fetcher)
+        
+        def fetch(record):
             place_id = record.get('id')
-            location_name = record.get('location_name', {}).get('text', 'N/A')
-            alias = record.get('alias', 'N/A')
-            
-            # print(f"[{i}/{total_count}] 処理中: {location_name} (alias: {alias})")
-            
             if not place_id:
-                print(f"⚠ Place IDが見つかりません: {location_name}")
-                failed_count += 1
-                continue
+                return None
+            return get_business_status(place_id, places_client)
+        
+        # 取得結果はバックグラウンドのbulk_writeステージに流し、取得と書き込みを並行させる
+        with BulkWriter(collection, batch_size=batch_size, flush_interval=flush_interval) as writer:
             
-            # テスト用: 最初の1件のみ処理
-            # if i > 1:
-            #     print(f"⚠ テスト用: 1件のみ処理するためスキップ: {location_name}")
-            #     continue
+            def finish(record, update=None):
+                """更新を書き込みキューに追加する。リース利用時は処理済みにしてリースを手放す"""
+                if lease_queue is not None:
+                    writer.update_one(lease_queue.filter(record), lease_queue.done_update(update))
+                elif update:
+                    writer.update_one({"_id": record["_id"]}, update)
             
-            # business_statusを取得
-            business_status = get_business_status(place_id, api_key)
+            def apply_now(record, update):
+                """更新をすぐに書き込み、書き込めた場合だけTrueを返す。リースを失っていた場合はFalse"""
+                nonlocal applied_modified, applied_lost, failed_count
+                if lease_queue is not None:
+                    filter, update = lease_queue.filter(record), lease_queue.done_update(update)
+                else:
+                    filter = {"_id": record["_id"]}
+                try:
+                    with metrics.stage("mongo_write"):
+                        result = collection.update_one(filter, update)
+                except PyMongoError as e:
+                    print(f"❌ 書き込みに失敗しました: {record.get('id')} - {str(e)}")
+                    failed_count += 1
+                    return False
+                if not result.matched_count:
+                    applied_lost += 1
+                    return False
+                applied_modified += result.modified_count
+                return True
             
-            if business_status:
-                # business_status情報を取得できた場合
-                update_data = {
-                    "businessStatus": business_status
-                }
+            results = fetcher.map_unordered(fetch, records_to_check)
+            for i, (record, business_status) in enumerate(results, 1):
+                processed_count = i
+                place_id = record.get('id')
+                location_name = record.get('location_name', {}).get('text', 'N/A')
+                alias = record.get('alias', 'N/A')
                 
-                # 閉業の場合はカウントを増やす
-                if business_status == "CLOSED_PERMANENTLY":
-                    closed_count += 1
-                    print(f"✓ 閉業店舗を発見: {location_name}")
-                    
-                    # 閉業店舗の情報をリストに追加
-                    address = record.get('address', '住所情報なし')
-                    closed_businesses.append({
-                        'name': location_name,
-                        'address': address,
-                        'alias': alias,
-                        'place_id': place_id
-                    })
+                verbose(f"[{i}] 処理中: {location_name} (alias: {alias})")
                 
-                # MongoDB更新を実行
-                result = collection.update_one(
-                    {"_id": record["_id"]},
-                    {"$set": update_data}
-                )
+                if not place_id:
+                    print(f"⚠ Place IDが見つかりません: {location_name}")
+                    failed_count += 1
+                    metrics.incr("missing_place_id")
+                    finish(record)
+                    continue
                 
-                if result.modified_count > 0:
-                    updated_count += 1
-                    print(f"✓ business_status更新完了: {location_name}")
+                if business_status and not content_changed(record, "businessStatus", business_status):
+                    # 前回と同じ値ならbusinessStatusは書き込まず、取得日時と次回更新日時だけを進める
+                    unchanged_count += 1
+                    metrics.incr("unchanged")
+                    finish(record, {"$set": freshness_update(record, ["businessStatus"], utcnow())})
+                elif business_status:
+                    # business_status情報を取得できた場合
+                    update_data = {
+                        "businessStatus": business_status,
+                        f"{CONTENT_HASH_FIELD}.businessStatus": content_hash("businessStatus", business_status),
+                        **freshness_update(record, ["businessStatus"], utcnow(),
+                                           closed=business_status == "CLOSED_PERMANENTLY")
+                    }
+                    
+                    # 閉業の場合はカウントを増やす
+                    previous_status = record.get('businessStatus')
+                    if business_status == "CLOSED_PERMANENTLY":
+                        closed_count += 1
+                        print(f"✓ 閉業店舗を発見: {location_name}")
+                    
+                    # 営業状態の変化は、書き込めた場合だけイベントログに追記する（初めて取得した営業中の状態は除く）
+                    if previous_status or business_status == "CLOSED_PERMANENTLY":
+                        if apply_now(record, {"$set": update_data}):
+                            changed_count += 1
+                            event_log.append("businessStatus", record, previous=previous_status,
+                                             current=business_status, address=record.get('address'))
+                    else:
+                        # MongoDB更新を書き込みキューに追加
+                        finish(record, {"$set": update_data})
+                        changed_count += 1
+                    metrics.incr(business_status.lower())
                 else:
-                    print(f"⚠ 更新失敗: {location_name}")
+                    verbose(f"⚠ business_status取得失敗: {location_name}")
                     failed_count += 1
-            else:
-                print(f"⚠ business_status取得失敗: {location_name}")
-                failed_count += 1
-            
-            # API制限を考慮して少し待機
-            time.sleep(0.1)
+                    metrics.incr("fetch_failed")
+                    finish(record)
+                
+                verbose("-" * 40)
+        
+        # リースを他のワーカーに取られ、結果を書き込めなかった件数
+        lost_count = (writer.unmatched_count if lease_queue is not None else 0) + applied_lost
+        metrics.incr("lease_lost", lost_count)
+        return {
+            "processed": processed_count,
+            "lost": lost_count,
+            "unchanged": unchanged_count,
+            "changed": changed_count,
+            "closed": closed_count,
+            "failed": failed_count + writer.error_count + lost_count,
+            "batches": writer.batch_count,
+            "modified": writer.modified_count + applied_modified,
+            "events": event_log.count,
+            **{key: value - cache_start[key] for key, value in cache_counts().items()},
+        }
+    finally:
+        event_log.close()
+        if lease_queue is not None:
+            lease_queue.close()
+        client.close()
+
+def update_closed_business_status(concurrency=8, rate=10.0, batch_size=500, flush_interval=2.0,
+                                  snapshot=True, partitions=1, lease_job=None,
+                                  lease_seconds=DEFAULT_LEASE_SECONDS, event_log_path=None):
+    """閉業店舗（CLOSED_PERMANENTLY）のbusiness_statusを更新する
+
+    partitionsが2以上の場合は_idの範囲で分割し、別プロセスで並行して処理する。
+    同時リクエスト数とレートは全プロセスの合計が指定値になるように分ける。
+    lease_jobを指定すると、同じジョブ名で実行している他のホストとレコードを分担する。
+    event_log_pathを省略した場合は環境変数PLACES_EVENT_LOGかデフォルトのファイルに追記する。
+    """
+    event_log_path = event_log_path or default_event_log_path()
+    
+    # MongoDB接続
+    client = MongoClient(os.environ["MONGODB_ADDRESS"])
+    db = client.places
+    collection = db.place_info
+    
+    try:
+        with metrics.stage("mongo_read"):
+            # 全レコード数はメタデータから求める（件数の表示にしか使わない）
+            all_records_count = collection.estimated_document_count()
             
-            print("-" * 40)
+            # 対象があるかだけを確認する（件数は処理しながら数える）
+            has_target = collection.find_one(UNCLOSED_QUERY, {"_id": 1}) is not None
+        
+        print(f"📊 データベース統計:")
+        print(f"   • 全レコード数（推定）: {all_records_count}件")
+        if not has_target:
+            print("✓ すべてのレコードのbusiness_statusが確認済みです")
+            return
+        
+        if lease_job:
+            ensure_lease_index(collection, "update_business_status")
+            print(f"   • ジョブ: {lease_job}（リース {lease_seconds}秒）")
+        
+        ranges = id_ranges(collection, partitions)
+        print(f"   • 分割数: {len(ranges)}")
+        print("=" * 60)
+        
+        results = run_partitions(update_partition, ranges, -(-concurrency // len(ranges)),
+                                 rate / len(ranges), batch_size, flush_interval, lease_job, lease_seconds,
+                                 event_log_path)
+        result = combine_results(results)
         
         print("=" * 60)
         print(f"📊 処理結果:")
-        print(f"   • 総対象レコード数: {total_count}件")
-        print(f"   • 更新成功: {updated_count}件")
-        print(f"   • 閉業店舗としてマーキング: {closed_count}件")
-        print(f"   • 更新失敗: {failed_count}件")
+        print(f"   • 総対象レコード数: {result['processed']}件")
+        print(f"   • 書き込みバッチ数: {result['batches']}件")
+        print(f"   • 更新成功: {result['modified']}件")
+        print(f"   • 営業状態の変更: {result['changed']}件")
+        print(f"   • 変更なし（取得日時のみ更新）: {result['unchanged']}件")
+        print(f"   • 閉業店舗としてマーキング: {result['closed']}件")
+        print(f"   • 更新失敗: {result['failed']}件")
+        if result['lost']:
+            print(f"   • うちリースを失い書き込めなかった件数: {result['lost']}件")
+        if default_cache():
+            print(f"   • キャッシュ: ヒット {result['cache_hits']}件 / ミス {result['cache_misses']}件")
         print("=" * 60)
         
-        # 閉業店舗リストをファイルに保存
-        if closed_businesses:
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            filename = f"closed_businesses_{timestamp}.json"
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(closed_businesses, f, ensure_ascii=False, indent=2)
-            
-            print(f"📄 閉業店舗リストを保存しました: {filename}")
-            print(f"   • 保存件数: {len(closed_businesses)}件")
-            
-            # テキストファイルでも保存（読みやすい形式）
-            txt_filename = f"closed_businesses_{timestamp}.txt"
-            with open(txt_filename, 'w', encoding='utf-8') as f:
-                f.write(f"閉業店舗一覧 ({len(closed_businesses)}件)\n")
-                f.write("=" * 50 + "\n\n")
-                for i, business in enumerate(closed_businesses, 1):
-                    f.write(f"{i}. {business['name']}\n")
-                    f.write(f"   住所: {business['address']}\n")
-                    f.write(f"   エイリアス: {business['alias']}\n")
-                    f.write(f"   Place ID: {business['place_id']}\n")
-                    f.write("-" * 30 + "\n")
-            
-            print(f"📄 閉業店舗リスト（テキスト形式）を保存しました: {txt_filename}")
+        # 営業状態の変化は処理中にイベントログへ追記済み
+        if result['events']:
+            print(f"📄 営業状態の変化をイベントログに追記しました: {event_log_path}（{result['events']}件）")
         else:
-            print("📄 閉業店舗は見つかりませんでした")
+            print("📄 営業状態が変化した店舗は見つかりませんでした")
+        
+        # 営業状態が変わった場合だけ地図表示用のスナップショットを書き直す（取得日時だけの更新では書き直さない）
+        if snapshot and result['changed']:
+            export_snapshots(collection)
         
     except Exception as e:
         print(f"❌ 処理中にエラーが発生しました: {str(e)}")
     finally:
         client.close()
 
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='閉業店舗（CLOSED_PERMANENTLY）のbusiness_statusを更新する')
+    parser.add_argument('--concurrency', '-n', type=int, default=8,
+                       help='Places APIへの同時リクエスト数（デフォルト: 8）')
+    parser.add_argument('--rate', '-r', type=float, default=10.0,
+                       help='1秒あたりの最大APIリクエスト数（デフォルト: 10）')
+    parser.add_argument('--batch-size', '-b', type=int, default=500,
+                       help='bulk_writeでまとめて書き込む件数（デフォルト: 500）')
+    parser.add_argument('--flush-interval', type=float, default=2.0,
+                       help='バッチを強制的に書き込むまでの秒数（デフォルト: 2.0）')
+    parser.add_argument('--no-snapshot', action='store_true',
+                       help='終了時に地図表示用のスナップショットを書き出さない')
+    parser.add_argument('--partitions', '-P', type=int, default=1,
+                       help='_idの範囲で分割して別プロセスで処理する数（デフォルト: 1）')
+    parser.add_argument('--lease-job', nargs='?', const=default_job("update_business_status"),
+                       help='リースを使い、同じジョブ名で実行中の他のホストと処理を分担する'
+                            '（名前を省略すると「スクリプト名:日付」）')
+    parser.add_argument('--event-log',
+                       help='営業状態の変化を追記するファイル（デフォルト: 環境変数PLACES_EVENT_LOG、なければplace_events.jsonl）')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                       help=f'リースの有効期限（秒、デフォルト: {DEFAULT_LEASE_SECONDS}）')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_arguments()
+    instrumentation.set_verbosity(args.verbose)
+    metrics.script = "update_business_status"
     print("🔄 business_status情報の更新を開始します...")
-    update_closed_business_status()
+    update_closed_business_status(args.concurrency, args.rate,
+                                  args.batch_size, args.flush_interval,
+                                  snapshot=not args.no_snapshot, partitions=args.partitions,
+                                  lease_job=args.lease_job, lease_seconds=args.lease_seconds,
+                                  event_log_path=args.event_log)
+    if args.metrics_file:
+        metrics.write(args.metrics_file, args.metrics_format)
     print("✅ 処理が完了しました") 
\ No newline at end of file
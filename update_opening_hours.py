@@ -1,158 +1,258 @@
 import os
-import requests
-import json
+import argparse
 from dotenv import load_dotenv
 from pymongo import MongoClient
-import time
+from places_fetch import PlacesFetcher
+from places_client import PlacesApiError, PlacesClient
+from bulk_writer import BulkWriter
+from places_cache import cache_counts, default_cache
+from freshness import freshness_update, utcnow
+from opening_intervals import ensure_open_intervals_index
+from place_document import CONTENT_HASH_FIELD, HOURS_UNKNOWN_STATUS, content_hash, opening_hours_fields
+import instrumentation
+from instrumentation import metrics, verbose
+from snapshot_export import export_snapshots
+from collection_scan import SCAN_PROJECTION, combine_results, id_ranges, partition_query, run_partitions
+from work_lease import DEFAULT_LEASE_SECONDS, LeaseQueue, default_job, ensure_lease_index
 
 load_dotenv()
 
-def get_opening_hours(place_id, api_key):
+def get_opening_hours(place_id, places_client):
     """営業時間情報を取得する関数"""
-    url = f"https://places.googleapis.com/v1/places/{place_id}?languageCode=ja"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-FieldMask": "currentOpeningHours",
-        "X-Goog-Api-Key": api_key,
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            result = response.json()
-            opening_hours = result.get('currentOpeningHours')
-            if opening_hours:
-                print(f"✓ 営業時間を取得しました: {place_id}")
-                return opening_hours
-            else:
-                print(f"⚠ 営業時間情報がありません: {place_id}")
-                return None
+        opening_hours = places_client.get_place(place_id, ["currentOpeningHours"]).opening_hours
+        if opening_hours:
+            verbose(f"✓ 営業時間を取得しました: {place_id}")
+            return opening_hours
         else:
-            print(f"❌ API呼び出しエラー: {place_id} - Status: {response.status_code}")
-            print(f"Response: {response.text}")
+            verbose(f"⚠ 営業時間情報がありません: {place_id}")
             return None
+    except PlacesApiError as e:
+        print(f"❌ API呼び出しエラー: {place_id} - {str(e)}")
+        return None
     except Exception as e:
         print(f"❌ エラーが発生しました: {place_id} - {str(e)}")
         return None
 
-def update_opening_hours_for_missing_records():
-    """openingHoursを持たないレコードの営業時間を更新する"""
+# openingHoursがNoneかつ、まだ「営業時間不明店舗」としてマーキングされておらず、永久閉店でないレコード
+MISSING_HOURS_QUERY = {
+    "$and": [
+        {"businessStatus": {"$ne": "CLOSED_PERMANENTLY"}},
+        {
+            "$or": [
+                {"openingHours": {"$exists": False}},
+                {"openingHours": None}
+            ]
+        },
+        {
+            "$or": [
+                {"openingHoursStatus": {"$exists": False}},
+                {"openingHoursStatus": {"$ne": HOURS_UNKNOWN_STATUS}}
+            ]
+        }
+    ]
+}
+
+def update_partition(id_range, concurrency, rate, batch_size, flush_interval, lease_job=None,
+                     lease_seconds=DEFAULT_LEASE_SECONDS):
+    """_idの範囲内で営業時間を持たないレコードを更新し、件数を辞書で返す"""
     
-    # MongoDB接続
+    # プロセスごとに接続する
     client = MongoClient(os.environ["MONGODB_ADDRESS"])
-    db = client.places
-    collection = db.place_info
+    collection = client.places.place_info
     
     # Google APIキー
     api_key = os.environ["GOOGLE_MAPS_API_KEY"]
     
+    # キャッシュの集計はプロセスごとなので、この範囲の分だけを返して親プロセスで合算する
+    cache_start = cache_counts()
+    lease_queue = None
+    
     try:
-        # openingHoursがNoneかつ、まだ「営業時間不明店舗」としてマーキングされていないレコードを検索
-        query_condition = {
-            "$and": [
-                {
-                    "$or": [
-                        {"openingHours": {"$exists": False}},
-                        {"openingHours": None}
-                    ]
-                },
-                {
-                    "$or": [
-                        {"openingHoursStatus": {"$exists": False}},
-                        {"openingHoursStatus": {"$ne": "営業時間不明店舗"}}
-                    ]
-                }
-            ]
-        }
-        
-        records_without_hours = collection.find(query_condition)
-        
-        # 全レコード数を確認
-        all_records_count = collection.count_documents({})
-        
-        # レコード数を確認
-        total_count = collection.count_documents(query_condition)
-        
-        print(f"📊 データベース統計:")
-        print(f"   • 全レコード数: {all_records_count}件")
-        print(f"   • 営業時間情報が不足しているレコード数: {total_count}件")
-        print(f"   • 営業時間情報が存在するレコード数: {all_records_count - total_count}件")
-        # total_count = 0;
-        if total_count == 0:
-            print("✓ すべてのレコードに営業時間情報が存在します")
-            return
-        
-        print("=" * 60)
+        query = partition_query(MISSING_HOURS_QUERY, id_range)
+        if lease_job:
+            # 他のホスト・プロセスと同じレコードを処理しないよう、リースを取りながら1件ずつ読み込む
+            lease_queue = LeaseQueue(collection, query, "update_opening_hours", lease_job, SCAN_PROJECTION, lease_seconds)
+            lease_queue.start()
+            records = lease_queue
+        else:
+            # 必要なフィールドだけを読み込む
+            records = collection.find(query, SCAN_PROJECTION)
+        records_without_hours = metrics.timed_iter("mongo_read", records)
         
-        updated_count = 0
+        processed_count = 0
         failed_count = 0
         
-        for i, record in enumerate(records_without_hours, 1):
+        # 並列・レート制限付きで営業時間を取得する（time.sleepによる待機の代わり）
+        fetcher = PlacesFetcher(concurrency=concurrency, rate=rate)
+        places_client = PlacesClient(api_key, fetcher)
+        
+        def fetch(record):
             place_id = record.get('id')
-            location_name = record.get('location_name', {}).get('text', 'N/A')
-            alias = record.get('alias', 'N/A')
-            
-            print(f"[{i}/{total_count}] 処理中: {location_name} (alias: {alias})")
-            
             if not place_id:
-                print(f"⚠ Place IDが見つかりません: {location_name}")
-                failed_count += 1
-                continue
+                return None
+            return get_opening_hours(place_id, places_client)
+        
+        # 取得結果はバックグラウンドのbulk_writeステージに流し、取得と書き込みを並行させる
+        with BulkWriter(collection, batch_size=batch_size, flush_interval=flush_interval) as writer:
+            
+            def finish(record, update=None):
+                """更新を書き込みキューに追加する。リース利用時は処理済みにしてリースを手放す"""
+                if lease_queue is not None:
+                    writer.update_one(lease_queue.filter(record), lease_queue.done_update(update))
+                elif update:
+                    writer.update_one({"_id": record["_id"]}, update)
             
-            # 営業時間を取得
-            opening_hours = get_opening_hours(place_id, api_key)
-            # opening_hours = None
-            if opening_hours:
-                # 営業時間情報を取得できた場合
-                result = collection.update_one(
-                    {"_id": record["_id"]},
-                    {"$set": {
-                        "openingHours": opening_hours,
-                        "openingHoursStatus": "available"
-                    }}
-                )
+            results = fetcher.map_unordered(fetch, records_without_hours)
+            for i, (record, opening_hours) in enumerate(results, 1):
+                processed_count = i
+                place_id = record.get('id')
+                location_name = record.get('location_name', {}).get('text', 'N/A')
+                alias = record.get('alias', 'N/A')
                 
-                if result.modified_count > 0:
-                    updated_count += 1
-                    print(f"✓ 営業時間更新完了: {location_name}")
-                else:
-                    print(f"⚠ 更新失敗: {location_name}")
+                verbose(f"[{i}] 処理中: {location_name} (alias: {alias})")
+                
+                if not place_id:
+                    print(f"⚠ Place IDが見つかりません: {location_name}")
                     failed_count += 1
-            else:
-                # 営業時間情報を取得できなかった場合は「営業時間不明店舗」としてマーキング
-                result = collection.update_one(
-                    {"_id": record["_id"]},
-                    {"$set": {
-                        "openingHours": None,
-                        "openingHoursStatus": "営業時間不明店舗"
-                    }}
-                )
+                    metrics.incr("missing_place_id")
+                    finish(record)
+                    continue
                 
-                if result.modified_count > 0:
-                    updated_count += 1
-                    print(f"✓ 営業時間不明店舗としてマーキング完了: {location_name}")
+                # opening_hours = None
+                if opening_hours:
+                    # 営業時間情報を取得できた場合
+                    finish(record, {"$set": {
+                        **opening_hours_fields(opening_hours),
+                        f"{CONTENT_HASH_FIELD}.currentOpeningHours": content_hash("currentOpeningHours", opening_hours),
+                        **freshness_update(record, ["currentOpeningHours"], utcnow())
+                    }})
+                    metrics.incr("hours_available")
+                    verbose(f"✓ 営業時間を書き込みキューに追加: {location_name}")
                 else:
-                    print(f"⚠ マーキング失敗: {location_name}")
-                    failed_count += 1
-            
-            # API制限を考慮して少し待機
-            time.sleep(0.1)
+                    # 営業時間情報を取得できなかった場合は「営業時間不明店舗」としてマーキング
+                    finish(record, {"$set": {
+                        **opening_hours_fields(None),
+                        f"{CONTENT_HASH_FIELD}.currentOpeningHours": content_hash("currentOpeningHours", None),
+                        **freshness_update(record, ["currentOpeningHours"], utcnow())
+                    }})
+                    metrics.incr("hours_unknown")
+                    verbose(f"✓ 営業時間不明店舗としてマーキングをキューに追加: {location_name}")
+                
+                verbose("-" * 40)
+        
+        # リースを他のワーカーに取られ、結果を書き込めなかった件数
+        lost_count = writer.unmatched_count if lease_queue is not None else 0
+        metrics.incr("lease_lost", lost_count)
+        return {
+            "processed": processed_count,
+            "lost": lost_count,
+            "failed": failed_count + writer.error_count + lost_count,
+            "batches": writer.batch_count,
+            "modified": writer.modified_count,
+            **{key: value - cache_start[key] for key, value in cache_counts().items()},
+        }
+    finally:
+        if lease_queue is not None:
+            lease_queue.close()
+        client.close()
+
+def update_opening_hours_for_missing_records(concurrency=8, rate=10.0, batch_size=500, flush_interval=2.0,
+                                             snapshot=True, partitions=1, lease_job=None,
+                                             lease_seconds=DEFAULT_LEASE_SECONDS):
+    """openingHoursを持たないレコードの営業時間を更新する
+
+    partitionsが2以上の場合は_idの範囲で分割し、別プロセスで並行して処理する。
+    同時リクエスト数とレートは全プロセスの合計が指定値になるように分ける。
+    lease_jobを指定すると、同じジョブ名で実行している他のホストとレコードを分担する。
+    """
+    
+    # MongoDB接続
+    client = MongoClient(os.environ["MONGODB_ADDRESS"])
+    db = client.places
+    collection = db.place_info
+    
+    try:
+        ensure_open_intervals_index(collection)
+        
+        with metrics.stage("mongo_read"):
+            # 全レコード数はメタデータから求める（件数の表示にしか使わない）
+            all_records_count = collection.estimated_document_count()
             
-            print("-" * 40)
+            # 対象があるかだけを確認する（件数は処理しながら数える）
+            has_target = collection.find_one(MISSING_HOURS_QUERY, {"_id": 1}) is not None
+        
+        print(f"📊 データベース統計:")
+        print(f"   • 全レコード数（推定）: {all_records_count}件")
+        if not has_target:
+            print("✓ すべてのレコードに営業時間情報が存在します")
+            return
+        
+        if lease_job:
+            ensure_lease_index(collection, "update_opening_hours")
+            print(f"   • ジョブ: {lease_job}（リース {lease_seconds}秒）")
+        
+        ranges = id_ranges(collection, partitions)
+        print(f"   • 分割数: {len(ranges)}")
+        print("=" * 60)
+        
+        results = run_partitions(update_partition, ranges, -(-concurrency // len(ranges)),
+                                 rate / len(ranges), batch_size, flush_interval, lease_job, lease_seconds)
+        result = combine_results(results)
         
         print("=" * 60)
         print(f"📊 処理結果:")
-        print(f"   • 総対象レコード数: {total_count}件")
-        print(f"   • 更新成功: {updated_count}件")
-        print(f"   • 更新失敗: {failed_count}件")
+        print(f"   • 総対象レコード数: {result['processed']}件")
+        print(f"   • 書き込みバッチ数: {result['batches']}件")
+        print(f"   • 更新成功: {result['modified']}件")
+        print(f"   • 更新失敗: {result['failed']}件")
+        if result['lost']:
+            print(f"   • うちリースを失い書き込めなかった件数: {result['lost']}件")
+        if default_cache():
+            print(f"   • キャッシュ: ヒット {result['cache_hits']}件 / ミス {result['cache_misses']}件")
         print("=" * 60)
         
+        # 変更があった場合は地図表示用のスナップショットを書き直す
+        if snapshot and result['modified']:
+            export_snapshots(collection)
+        
     except Exception as e:
         print(f"❌ 処理中にエラーが発生しました: {str(e)}")
     finally:
         client.close()
 
+def parse_arguments():
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description='openingHoursを持たないレコードの営業時間を更新する')
+    parser.add_argument('--concurrency', '-n', type=int, default=8,
+                       help='Places APIへの同時リクエスト数（デフォルト: 8）')
+    parser.add_argument('--rate', '-r', type=float, default=10.0,
+                       help='1秒あたりの最大APIリクエスト数（デフォルト: 10）')
+    parser.add_argument('--batch-size', '-b', type=int, default=500,
+                       help='bulk_writeでまとめて書き込む件数（デフォルト: 500）')
+    parser.add_argument('--flush-interval', type=float, default=2.0,
+                       help='バッチを強制的に書き込むまでの秒数（デフォルト: 2.0）')
+    parser.add_argument('--no-snapshot', action='store_true',
+                       help='終了時に地図表示用のスナップショットを書き出さない')
+    parser.add_argument('--partitions', '-P', type=int, default=1,
+                       help='_idの範囲で分割して別プロセスで処理する数（デフォルト: 1）')
+    parser.add_argument('--lease-job', nargs='?', const=default_job("update_opening_hours"),
+                       help='リースを使い、同じジョブ名で実行中の他のホストと処理を分担する'
+                            '（名前を省略すると「スクリプト名:日付」）')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                       help=f'リースの有効期限（秒、デフォルト: {DEFAULT_LEASE_SECONDS}）')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_arguments()
+    instrumentation.set_verbosity(args.verbose)
+    metrics.script = "update_opening_hours"
     print("🔄 営業時間情報の更新を開始します...")
-    update_opening_hours_for_missing_records()
+    update_opening_hours_for_missing_records(args.concurrency, args.rate,
+                                             args.batch_size, args.flush_interval,
+                                             snapshot=not args.no_snapshot, partitions=args.partitions,
+                                             lease_job=args.lease_job, lease_seconds=args.lease_seconds)
+    if args.metrics_file:
+        metrics.write(args.metrics_file, args.metrics_format)
     print("✅ 処理が完了しました") 
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from freshness import utcnow
+from instrumentation import metrics
+
+# レコードの処理権（リース）を記録するフィールド。leases.<スクリプト名> にスクリプトごとに持つ
+LEASES_FIELD = "leases"
+
+# リースの有効期限（秒）。この間にハートビートがなければ他のワーカーが取り直す
+DEFAULT_LEASE_SECONDS = 300
+
+
+def default_owner():
+    """ホスト名・プロセスID・乱数からワーカーを識別する文字列を作る"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def default_job(script):
+    """同じ日に同じスクリプトを実行したワーカー同士で共有するジョブ名"""
+    return f"{script}:{time.strftime('%Y-%m-%d', time.gmtime())}"
+
+
+def lease_field(name):
+    """スクリプト名nameのリースを記録するフィールド"""
+    return f"{LEASES_FIELD}.{name.replace('.', '_').replace('$', '_')}"
+
+
+def ensure_lease_index(collection, name):
+    """ハートビートとリースの解放で使うインデックスを作成する"""
+    collection.create_index(f"{lease_field(name)}.owner", sparse=True)
+
+
+class LeaseQueue:
+    """MongoDB上のリースで、複数のホスト・プロセスが同じレコードを重複して処理しないようにする
+
+    queryに一致するレコードをfind_one_and_updateで1件ずつ取得し、同時に
+    leases.<name> = {job, owner, expiresAt} を書き込む。リースはスクリプト（name）ごとに
+    別のフィールドに持つため、別のスクリプトのリースとは干渉しない。
+    同じjobで処理済み（doneAtあり）のレコードと、他のワーカーが期限内のリースを持つレコードは
+    jobによらず取得しない（日付をまたいでジョブ名が変わっても二重に処理しない）。
+    期限切れのリースはワーカーが停止したものとみなして取り直す。
+    取得中のリースはバックグラウンドのハートビートで延長する。
+    """
+
+    def __init__(self, collection, query, name, job, projection=None,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, owner=None):
+        self.collection = collection
+        self.query = query
+        self.field = lease_field(name)
+        self.job = job
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.projection = dict(projection, **{self.field: 1}) if projection else None
+        self.claimed_count = 0
+        self.reclaimed_count = 0
+        self._last_id = None
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._run_heartbeat, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __iter__(self):
+        while not self._stop.is_set():
+            record = self.claim()
+            if record is None:
+                return
+            yield record
+
+    def _claim_query(self, now, after=None):
+        lease = self.field
+        conditions = [self.query, {"$or": [
+            {lease: None},
+            # 別のジョブで処理を終えたもの
+            {f"{lease}.doneAt": {"$exists": True}, f"{lease}.job": {"$ne": self.job}},
+            # 処理中のまま期限が切れたもの（ジョブによらない）
+            {f"{lease}.doneAt": {"$exists": False}, f"{lease}.expiresAt": {"$lte": now}},
+        ]}]
+        if after is not None:
+            conditions.append({"_id": {"$gt": after}})
+        return {"$and": conditions}
+
+    def _expires_at(self, now):
+        return now + timedelta(seconds=self.lease_seconds)
+
+    def claim(self):
+        """未処理のレコードを1件取得してリースを設定する。なければNone
+
+        _idの昇順に前回の続きから探し、見つからなければ先頭から探し直して
+        停止したワーカーが残した期限切れのリースを拾う。
+        """
+        now = utcnow()
+        lease = {"job": self.job, "owner": self.owner, "expiresAt": self._expires_at(now)}
+        for after in ([self._last_id, None] if self._last_id is not None else [None]):
+            with metrics.stage("mongo_claim"):
+                record = self.collection.find_one_and_update(
+                    self._claim_query(now, after), {"$set": {self.field: lease}},
+                    projection=self.projection, sort=[("_id", 1)])
+            if record is None:
+                continue
+            self._last_id = record["_id"]
+            self.claimed_count += 1
+            previous = (record.pop(LEASES_FIELD, None) or {}).get(self.field.split(".", 1)[1]) or {}
+            if previous and not previous.get("doneAt"):
+                self.reclaimed_count += 1
+                metrics.incr("lease_reclaimed")
+            return record
+        return None
+
+    def filter(self, record):
+        """リースを持っている場合だけ書き込むための条件"""
+        return {"_id": record["_id"], f"{self.field}.owner": self.owner}
+
+    def done_update(self, update=None):
+        """updateにレコードを処理済みとする変更を加える"""
+        update = dict(update or {})
+        update["$set"] = {**update.get("$set", {}), f"{self.field}.doneAt": utcnow()}
+        update["$unset"] = {**update.get("$unset", {}), f"{self.field}.expiresAt": ""}
+        return update
+
+    def renew(self):
+        """処理中のリースの期限をまとめて延長する"""
+        with metrics.stage("mongo_write"):
+            self.collection.update_many(
+                {f"{self.field}.owner": self.owner, f"{self.field}.doneAt": {"$exists": False}},
+                {"$set": {f"{self.field}.expiresAt": self._expires_at(utcnow())}})
+
+    def _run_heartbeat(self):
+        interval = self.lease_seconds / 3
+        while not self._stop.wait(interval):
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"⚠️  リースを延長できませんでした: {str(e)}")
+
+    def start(self):
+        self._heartbeat.start()
+
+    def close(self):
+        """ハートビートを止め、処理を終えていないリースを解放して他のワーカーに渡す"""
+        self._stop.set()
+        if self._heartbeat.is_alive():
+            self._heartbeat.join()
+        self.collection.update_many(
+            {f"{self.field}.owner": self.owner, f"{self.field}.doneAt": {"$exists": False}},
+            {"$unset": {self.field: ""}})